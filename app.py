@@ -1,160 +1,295 @@
+import json
+from urllib.parse import urlencode
+
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash import dash_table, dcc, html
+from dash import ClientsideFunction
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
-from co2_data import clean_data
+import config
+from client_data import client_payload
+from correlation import ranked_correlations
+import figure_pool
+from data_store import (dataset_fingerprint, dataset_version, get_index, is_loaded, known_fingerprint,
+                        reload_if_changed)
+from figure_cache import cache_key, cached_figure, figure_cache, serialize_figure
+from figure_patch import figure_patch
+from export import register_export_routes
+from metrics import instrument_callback, register_routes
+from rollups import drill_down, expand_selection, region_names, series_names, split_selection
+from snapshot import default_figure, snapshot_countries
 from population_trend import create_population_trend_figure
 from co2_trend import create_co2_emission_trend_figure
-from co2_population_corr import create_population_co2_correlation_figure
+from co2_population_corr import create_population_co2_correlation_figure, create_rolling_correlation_figure
 from co2_sources import update_co2_sources_graph
 
+# Tab value -> (graph id, figure builder). Only the visible tab's figure is built.
+TAB_FIGURES = {
+    'co2-trend': ('co2-emission-graph', create_co2_emission_trend_figure),
+    'population-trend': ('population-trend-graph', create_population_trend_figure),
+    'correlation': ('correlation-graph', create_population_co2_correlation_figure),
+    'co2-sources': ('co2-emission-sources-graph', update_co2_sources_graph),
+}
+
+# Tabs whose filter changes are answered with a partial update (figure_patch).
+# The sources chart is left out: its slider redraws the figure in the browser,
+# so the server does not know what it shows.
+PATCHED_TABS = {'co2-trend', 'population-trend', 'correlation'}
+
+# Tabs whose figures are built in the browser in client-side filtering mode,
+# mapped to their function in assets/clientside.js
+CLIENTSIDE_TABS = {
+    'co2-trend': 'co2Trend',
+    'population-trend': 'populationTrend',
+    'correlation': 'correlation',
+}
+
+# Tabs whose figures the server builds
+SERVER_TABS = [tab for tab in TAB_FIGURES if not (config.CLIENTSIDE_FILTERING and tab in CLIENTSIDE_TABS)]
+
+# Filters the dashboard opens with
+DEFAULT_COUNTRIES = 'all'
+DEFAULT_START_YEAR = 1850
+DEFAULT_END_YEAR = 2023
+
 # Initialize Dash app
 app = dash.Dash(__name__)
 
-co2_data = clean_data("owid-co2-data.csv")
-
-# App Layout
-app.layout = html.Div(className="dashboard-container", children=[
-    # Dashboard Title
-    html.Div(className="dashboard-title", children="Global CO2 Emissions and Population Trends"),
-
-    # Date Picker and Country Dropdown
-    html.Div([
-        dcc.Dropdown(
-            id='country-dropdown',
-            options=[{'label': 'All Countries', 'value': 'all'}] + 
-                    [{'label': country, 'value': country} for country in sorted(co2_data['country'].unique())],
-            value='all',
-            multi=True,  # Allow multiple countries to be selected
-            placeholder="Select a country",
-            style={'width': '400px'}  # Adjust the width here
-        ),
-        # Year Input Range
+# Prometheus metrics on /metrics
+register_routes(app.server)
+
+# Downloads of the filtered data on /export
+register_export_routes(app.server)
+
+
+def placeholder_figure(text="Loading..."):
+    # Empty figure shown until a tab's real figure arrives
+    return {
+        'data': [],
+        'layout': {
+            'xaxis': {'visible': False},
+            'yaxis': {'visible': False},
+            'paper_bgcolor': 'white',
+            'plot_bgcolor': 'white',
+            'annotations': [{
+                'text': text, 'showarrow': False, 'font': {'size': 18, 'color': 'gray'},
+                'xref': 'paper', 'yref': 'paper', 'x': 0.5, 'y': 0.5,
+            }],
+        },
+    }
+
+
+def country_options():
+    # Country list saved with the default-view snapshot when there is one (and
+    # kept in memory after the first read), so the first page does not have to
+    # wait for the dataset to load
+    countries = snapshot_countries()
+    if countries is None:
+        countries = get_index().countries
+    # The charts filtered in the browser only know countries
+    regions = [] if config.CLIENTSIDE_FILTERING else region_names()
+    return ([{'label': 'All Countries', 'value': 'all'}]
+            + [{'label': f"{region} (region)", 'value': region} for region in regions]
+            + [{'label': country, 'value': country} for country in countries])
+
+
+def export_url(selected_countries, start_year, end_year):
+    # /export link for the given filters
+    if isinstance(selected_countries, str):
+        selected_countries = [selected_countries]
+    query = [('countries', country) for country in selected_countries or []]
+    query += [(name, value) for name, value in (('start', start_year), ('end', end_year)) if value is not None]
+    return '/export?' + urlencode(query + [('format', 'csv')])
+
+
+# App Layout, built for every page load
+def serve_layout():
+    return html.Div(className="dashboard-container", children=[
+        # Dashboard Title
+        html.Div(className="dashboard-title", children="Global CO2 Emissions and Population Trends"),
+
+        # Date Picker and Country Dropdown
         html.Div([
-            html.Label('Start Year', style={'font-size': '12px', 'margin-right': '10px'}),
-            dcc.Input(id='start-year-input', type='number', value=1850, min=1750, max=2023, style={'width': '100px'}),
-
-            html.Label('End Year', style={'font-size': '12px', 'margin-left': '10px'}),
-            dcc.Input(id='end-year-input', type='number', value=2023, min=1750, max=2023, style={'width': '100px'})
-        ], style={'display': 'flex', 'align-items': 'center', 'margin-bottom': '20px'}),
-    ], style={'display': 'flex', 'justify-content': 'space-between', 'margin-bottom': '20px'}),
-
-    # Tabs
-    dcc.Tabs(id="tabs", children=[
-        # Tab 1: CO2 Emission Trend
-        dcc.Tab(label="CO2 Emission Trend", children=[
-            html.Div([ 
-                # Contextual Description (Top Left)
-                html.P(
-                    "This chart shows the historical trend of CO2 emissions for selected countries. "
-                    "Use the filter above to compare multiple countries and examine trends over time.",
-                    style={'font-size': '16px', 'color': 'black', 'margin-bottom': '15px', 'text-align': 'left'}
-                ),
-                # CO2 Emission Trend Graph (Resized to accommodate the interactive guide)
-                dcc.Graph(id="co2-emission-graph", figure=create_co2_emission_trend_figure('all', "1850-01-01", "2023-12-31"),
-                          style={'width': '80%', 'height': '500px'}),
-                
-                # Interactive Guide (Right Side)
-                html.Div(
+            dcc.Dropdown(
+                id='country-dropdown',
+                options=country_options(),
+                value=DEFAULT_COUNTRIES,
+                multi=True,  # Allow multiple countries to be selected
+                placeholder="Select a country",
+                style={'width': '400px'}  # Adjust the width here
+            ),
+            # Year Input Range
+            html.Div([
+                html.Label('Start Year', style={'font-size': '12px', 'margin-right': '10px'}),
+                dcc.Input(id='start-year-input', type='number', value=DEFAULT_START_YEAR, min=1750, max=2023, style={'width': '100px'}),
+
+                html.Label('End Year', style={'font-size': '12px', 'margin-left': '10px'}),
+                dcc.Input(id='end-year-input', type='number', value=DEFAULT_END_YEAR, min=1750, max=2023, style={'width': '100px'}),
+
+                # Numbers behind the current filters, as CSV
+                html.A('Download data', id='export-link', href=export_url(DEFAULT_COUNTRIES, DEFAULT_START_YEAR, DEFAULT_END_YEAR),
+                       style={'font-size': '12px', 'margin-left': '20px'})
+            ], style={'display': 'flex', 'align-items': 'center', 'margin-bottom': '20px'}),
+        ], style={'display': 'flex', 'justify-content': 'space-between', 'margin-bottom': '20px'}),
+
+        # Filters each tab's figure was last built with. A tab whose entry differs
+        # from the current filters is stale and gets rebuilt when it is shown.
+        html.Div([dcc.Store(id=f'{graph_id}-filters') for graph_id, _ in TAB_FIGURES.values()]),
+
+        # Fingerprint of the dataset on the server, updated by a periodic check of
+        # the data file; a change rebuilds the visible charts
+        dcc.Store(id='dataset-version'),
+        dcc.Interval(id='data-poll', interval=config.DATA_POLL_SECONDS * 1000),
+
+        # Compact dataset for client-side filtering, refreshed when the data changes
+        html.Div([dcc.Store(id='client-data')] if config.CLIENTSIDE_FILTERING else []),
+
+        # Tabs
+        dcc.Tabs(id="tabs", value='co2-trend', children=[
+            # Tab 1: CO2 Emission Trend
+            dcc.Tab(label="CO2 Emission Trend", value='co2-trend', children=[
+                html.Div([ 
+                    # Contextual Description (Top Left)
                     html.P(
-                        "Notice how CO2 emissions have changed over the years. Do any countries show "
-                        "significant increases or decreases? Think about what could influence these changes.", 
-                        style={'font-size': '15px','font-style': 'italic', 'color': 'black', 'text-align': 'right', 'width': '20%', 'margin-top': '-200px'}
+                        "This chart shows the historical trend of CO2 emissions for selected countries. "
+                        "Use the filter above to compare multiple countries and examine trends over time.",
+                        style={'font-size': '16px', 'color': 'black', 'margin-bottom': '15px', 'text-align': 'left'}
                     ),
-                    style={'display': 'flex', 'justify-content': 'flex-end', 'align-items': 'center', 'position': 'absolute', 'top': '350px', 'right': '50px'}
-                ),
-            ], style={'position': 'relative'}),
-        ]),
-
-        # Tab 2: Population Trend
-        dcc.Tab(label="Population Trend", children=[
-            html.Div([ 
-                # Contextual Description (Top Left)
-                html.P(
-                    "This chart visualizes population growth over time." 
-                    "Use the filter to explore different countries and understand how their populations have increased over the years",
-                    style={'font-size': '16px', 'color': 'black', 'margin-bottom': '15px', 'text-align': 'left'}
-                ),
-                # Population Trend Graph (Resized to accommodate the interactive guide)
-                dcc.Graph(id="population-trend-graph", figure=update_co2_sources_graph('all', "1850-01-01", "2023-12-31"),
-                          style={'width': '80%', 'height': '500px'}),
+                    # CO2 Emission Trend Graph (Resized to accommodate the interactive guide)
+                    dcc.Graph(id="co2-emission-graph", figure=placeholder_figure(),
+                              style={'width': '80%', 'height': '500px'}),
                 
-                # Interactive Guide (Right Side)
-                html.Div(
+                    # Interactive Guide (Right Side)
+                    html.Div(
+                        html.P(
+                            "Notice how CO2 emissions have changed over the years. Do any countries show "
+                            "significant increases or decreases? Think about what could influence these changes.", 
+                            style={'font-size': '15px','font-style': 'italic', 'color': 'black', 'text-align': 'right', 'width': '20%', 'margin-top': '-200px'}
+                        ),
+                        style={'display': 'flex', 'justify-content': 'flex-end', 'align-items': 'center', 'position': 'absolute', 'top': '350px', 'right': '50px'}
+                    ),
+                ], style={'position': 'relative'}),
+            ]),
+
+            # Tab 2: Population Trend
+            dcc.Tab(label="Population Trend", value='population-trend', children=[
+                html.Div([ 
+                    # Contextual Description (Top Left)
                     html.P(
-                        "As the population grows, what other factors could contribute to CO2 emissions? "
-                        "Explore the next tab to see how population growth relates to emissions.", 
-                        style={'font-size': '15px','font-style': 'italic', 'color': 'black', 'text-align': 'right', 'width': '20%', 'margin-top': '-200px'}
+                        "This chart visualizes population growth over time." 
+                        "Use the filter to explore different countries and understand how their populations have increased over the years",
+                        style={'font-size': '16px', 'color': 'black', 'margin-bottom': '15px', 'text-align': 'left'}
                     ),
-                    style={'display': 'flex', 'justify-content': 'flex-end', 'align-items': 'center', 'position': 'absolute', 'top': '350px', 'right': '50px'}
-                ),
-            ], style={'position': 'relative'}),
-        ]),
-
-        # Tab 3: Population-CO2 Correlation (Doesn't get affected by the date picker)
-        dcc.Tab(label="Population-CO2 Correlation", children=[
-            html.Div([ 
-                # Contextual Description (Top Left)
-                html.P(
-                    "This scatter plot examines the relationship between population size and CO2 emissions over time. "
-                    "Hover over each data point to view the year, population size, and CO2 emissions for that specific country and year.",
-                    style={'font-size': '16px', 'color': 'black', 'margin-bottom': '15px', 'text-align': 'left'}
-                ),
-                # Correlation Graph (Resized to accommodate the interactive guide)
-                dcc.Graph(id="correlation-graph", figure=create_population_co2_correlation_figure('all', "1850-01-01", "2023-12-31"),
-                          style={'width': '80%', 'height': '500px'}),
+                    # Population Trend Graph (Resized to accommodate the interactive guide)
+                    dcc.Graph(id="population-trend-graph", figure=placeholder_figure(),
+                              style={'width': '80%', 'height': '500px'}),
                 
-                # Interactive Guide (Right Side)
-                html.Div(
+                    # Interactive Guide (Right Side)
+                    html.Div(
+                        html.P(
+                            "As the population grows, what other factors could contribute to CO2 emissions? "
+                            "Explore the next tab to see how population growth relates to emissions.", 
+                            style={'font-size': '15px','font-style': 'italic', 'color': 'black', 'text-align': 'right', 'width': '20%', 'margin-top': '-200px'}
+                        ),
+                        style={'display': 'flex', 'justify-content': 'flex-end', 'align-items': 'center', 'position': 'absolute', 'top': '350px', 'right': '50px'}
+                    ),
+                ], style={'position': 'relative'}),
+            ]),
+
+            # Tab 3: Population-CO2 Correlation (Doesn't get affected by the date picker)
+            dcc.Tab(label="Population-CO2 Correlation", value='correlation', children=[
+                html.Div([ 
+                    # Contextual Description (Top Left)
                     html.P(
-                        "Does population growth consistently lead to increased CO2 emissions?  "
-                        "Use the country filter to explore specific nations and observe how their trends vary over time. "
-                        "Look for clusters or outliers to spot unique patterns.", 
-                        style={'font-size': '15px','font-style': 'italic', 'color': 'black', 'text-align': 'right', 'width': '20%', 'margin-top': '-200px'}
+                        "This scatter plot examines the relationship between population size and CO2 emissions over time. "
+                        "Hover over each data point to view the year, population size, and CO2 emissions for that specific country and year.",
+                        style={'font-size': '16px', 'color': 'black', 'margin-bottom': '15px', 'text-align': 'left'}
                     ),
-                    style={'display': 'flex', 'justify-content': 'flex-end', 'align-items': 'center', 'position': 'absolute', 'top': '350px', 'right': '50px'}
-                ),
-            ], style={'position': 'relative'}),
-        ]),
-
-        # Tab 4: CO2 Emission Sources
-        dcc.Tab(label="CO2 Emission Sources", children=[
-            html.Div([ 
-                # Contextual Description (Top Left)
-                html.P(
-                    "This chart breaks down CO2 emissions by source—coal, oil, natural gas, flaring, and cement—for each country. "
-                    "Use the filters to explore how the composition of CO2 sources varies between countries and over time.",
-                    style={'font-size': '16px', 'color': 'black', 'margin-bottom': '15px', 'text-align': 'left'}
-                ),
-                # CO2 Emission Sources Graph (Resized to accommodate the interactive guide)
-                dcc.Graph(id="co2-emission-sources-graph", figure=create_population_co2_correlation_figure('all', "1850-01-01", "2023-12-31"),
-                          style={'width': '80%', 'height': '500px'}),
+                    # Correlation Graph (Resized to accommodate the interactive guide)
+                    dcc.Graph(id="correlation-graph", figure=placeholder_figure(),
+                              style={'width': '80%', 'height': '500px'}),
+
+                    # Rolling correlation over the years, shown when one country is selected
+                    html.Div(id='rolling-correlation', children=[
+                        dcc.Graph(id='rolling-correlation-graph', figure=placeholder_figure(),
+                                  style={'height': '350px'}),
+                    ], style={'width': '80%', 'display': 'none'}),
+
+                    # Ranked correlation per country, shown when several countries are selected
+                    html.Div(id='correlation-ranking', children=[
+                        dash_table.DataTable(
+                            id='correlation-table',
+                            columns=[
+                                {'name': 'Country', 'id': 'country'},
+                                {'name': 'Correlation Coefficient', 'id': 'correlation', 'type': 'numeric'},
+                                {'name': 'Years', 'id': 'years', 'type': 'numeric'},
+                                {'name': 'Interpretation', 'id': 'interpretation'},
+                            ],
+                            page_size=10,
+                            sort_action='native',
+                            style_cell={'font-family': 'Roboto, sans-serif', 'font-size': '14px', 'text-align': 'left'},
+                            style_header={'font-weight': 'bold'},
+                        ),
+                    ], style={'width': '80%', 'margin-top': '20px'}),
                 
-                # Interactive Guide (Right Side)
-                html.Div(
+                    # Interactive Guide (Right Side)
+                    html.Div(
+                        html.P(
+                            "Does population growth consistently lead to increased CO2 emissions?  "
+                            "Use the country filter to explore specific nations and observe how their trends vary over time. "
+                            "Look for clusters or outliers to spot unique patterns.", 
+                            style={'font-size': '15px','font-style': 'italic', 'color': 'black', 'text-align': 'right', 'width': '20%', 'margin-top': '-200px'}
+                        ),
+                        style={'display': 'flex', 'justify-content': 'flex-end', 'align-items': 'center', 'position': 'absolute', 'top': '350px', 'right': '50px'}
+                    ),
+                ], style={'position': 'relative'}),
+            ]),
+
+            # Tab 4: CO2 Emission Sources
+            dcc.Tab(label="CO2 Emission Sources", value='co2-sources', children=[
+                html.Div([ 
+                    # Contextual Description (Top Left)
                     html.P(
-                        "Which sources contribute the most to CO2 emissions for each country? "
-                        "Are there countries that rely heavily on a single source, such as coal or oil?", 
-                        style={'font-size': '15px','font-style': 'italic', 'color': 'black', 'text-align': 'right', 'width': '20%', 'margin-top': '-200px'}
+                        "This chart breaks down CO2 emissions by source—coal, oil, natural gas, flaring, and cement—for each country. "
+                        "Use the filters to explore how the composition of CO2 sources varies between countries and over time.",
+                        style={'font-size': '16px', 'color': 'black', 'margin-bottom': '15px', 'text-align': 'left'}
+                    ),
+                    # CO2 Emission Sources Graph (Resized to accommodate the interactive guide)
+                    dcc.Graph(id="co2-emission-sources-graph", figure=placeholder_figure(),
+                              style={'width': '80%', 'height': '500px'}),
+
+                    # Year slider and Play button, drawn client-side in compact frame mode
+                    html.Div([
+                        html.Button('Play', id='co2-sources-play-button', n_clicks=0, style={'margin-right': '20px'}),
+                        html.Div(
+                            dcc.Slider(id='co2-sources-year-slider', min=1850, max=2023, step=1, value=1850,
+                                       marks=None, tooltip={'placement': 'bottom'}),
+                            style={'flex': '1'}
+                        ),
+                        dcc.Interval(id='co2-sources-play-interval', interval=500, disabled=True),
+                    ], style={'display': 'flex' if config.CO2_SOURCES_FRAME_MODE == 'compact' else 'none',
+                              'align-items': 'center', 'width': '80%'}),
+                
+                    # Interactive Guide (Right Side)
+                    html.Div(
+                        html.P(
+                            "Which sources contribute the most to CO2 emissions for each country? "
+                            "Are there countries that rely heavily on a single source, such as coal or oil?", 
+                            style={'font-size': '15px','font-style': 'italic', 'color': 'black', 'text-align': 'right', 'width': '20%', 'margin-top': '-200px'}
+                        ),
+                        style={'display': 'flex', 'justify-content': 'flex-end', 'align-items': 'center', 'position': 'absolute', 'top': '350px', 'right': '50px'}
                     ),
-                    style={'display': 'flex', 'justify-content': 'flex-end', 'align-items': 'center', 'position': 'absolute', 'top': '350px', 'right': '50px'}
-                ),
-            ], style={'position': 'relative'}),
-        ]),
+                ], style={'position': 'relative'}),
+            ]),
+        ])
     ])
-])
 
-# Callback for CO2 Emission Trend and Population Trend (Tabs 1 and 2)
-@app.callback(
-    [Output('co2-emission-graph', 'figure'),
-     Output('population-trend-graph', 'figure'),
-     Output('correlation-graph', 'figure'),
-     Output('co2-emission-sources-graph', 'figure')],
-    [Input('country-dropdown', 'value'),
-     Input('start-year-input', 'value'),
-     Input('end-year-input', 'value')]
-)
-def update_graphs(selected_countries, start_year, end_year):
+
+app.layout = serve_layout
+
+
+def figure_filters(selected_countries, start_year, end_year):
     # Convert years to date format 'YYYY-01-01' and 'YYYY-12-31'
     start_date = f"{start_year}-01-01"
     end_date = f"{end_year}-12-31"
@@ -162,20 +297,298 @@ def update_graphs(selected_countries, start_year, end_year):
     if not selected_countries or selected_countries == ['all']:
         selected_countries = None  # This allows all countries if 'all' is selected or if no countries are selected
 
-    # CO2 Emission Trend
-    co2_fig = create_co2_emission_trend_figure(selected_countries, start_date, end_date)
-    
-    # Population Trend
-    pop_fig = create_population_trend_figure(selected_countries, start_date, end_date)
-    
-    # Scatter Plot for Population and CO2
-    scatter_fig = create_population_co2_correlation_figure(selected_countries, start_date, end_date)
-    
-    # CO2 Emission Sources Graph (from the second script)
-    co2_source_fig = update_co2_sources_graph(selected_countries, start_date, end_date)  # Call the function from the second script
-    
-    return co2_fig, pop_fig, scatter_fig, co2_source_fig  # Return the updated figures
-    
+    return selected_countries, start_date, end_date
+
+
+def is_default_view(selected_countries, start_year, end_year):
+    return (cache_key('', selected_countries, start_year, end_year)
+            == cache_key('', DEFAULT_COUNTRIES, DEFAULT_START_YEAR, DEFAULT_END_YEAR))
+
+
+def tab_figure_payload(tab, selected_countries, start_year, end_year):
+    # Serialized figure for one tab, from the on-disk snapshot for the default
+    # view and built otherwise. Runs in the figure pool, so it must not rely
+    # on anything but its arguments and the data store.
+    builder = TAB_FIGURES[tab][1]
+
+    def build_payload():
+        return serialize_figure(tab, builder(*figure_filters(selected_countries, start_year, end_year)))
+
+    if is_default_view(selected_countries, start_year, end_year):
+        return default_figure(tab, build_payload)
+    return build_payload()
+
+
+def build_tab_figure(tab, selected_countries, start_year, end_year):
+    # Figure for one tab, served from the figure cache when this view was built
+    # before, taken from its background build when one is running (and started
+    # on the current data), or else built in the figure pool. Raises
+    # RuntimeError, and caches nothing, when the builder failed or did not
+    # finish within FIGURE_TIMEOUT_SECONDS.
+    args = (tab, selected_countries, start_year, end_year)
+    pending = (dataset_version(), cache_key(*args))
+
+    def build_payload():
+        payload = figure_pool.wait_pending(pending)
+        if payload is None:
+            payload = figure_pool.run_all({tab: (tab_figure_payload, args)}, fallback=lambda name: None)[tab]
+        if payload is None:
+            raise RuntimeError(f"The {tab} figure could not be built")
+        return payload
+
+    return cached_figure(tab, selected_countries, start_year, end_year, build_payload)
+
+
+def prefetch_tabs(tab, selected_countries, start_year, end_year):
+    # Build the other server-rendered tabs of this view in the figure pool, so
+    # switching to one of them is answered from the figure cache
+    version = dataset_version()
+    tasks = {}
+    for other in SERVER_TABS:
+        key = cache_key(other, selected_countries, start_year, end_year)
+        if other != tab and key not in figure_cache:
+            tasks[version, key] = (tab_figure_payload, (other, selected_countries, start_year, end_year))
+
+    def store(pending, payload):
+        # Unless the dataset was reloaded while it was being built
+        figure_cache.put(pending[1], payload, version)
+
+    figure_pool.prefetch(tasks, store)
+
+
+def register_tab_callback(tab, graph_id):
+
+    # Rebuild a tab's figure when it is visible and its filters or the dataset
+    # changed, either because the user edited them, because the data file was
+    # updated or because the tab was just selected
+    @app.callback(
+        [Output(graph_id, 'figure'),
+         Output(f'{graph_id}-filters', 'data')],
+        [Input('tabs', 'value'),
+         Input('country-dropdown', 'value'),
+         Input('start-year-input', 'value'),
+         Input('end-year-input', 'value'),
+         Input('dataset-version', 'data')],
+        [State(f'{graph_id}-filters', 'data')]
+    )
+    @instrument_callback(tab)
+    def update_tab_graph(active_tab, selected_countries, start_year, end_year, _, rendered_filters):
+        # Hidden tabs keep their (now stale) figure until they are shown
+        if active_tab != tab:
+            raise PreventUpdate
+
+        # The dataset the figure was built from is stored with its filters, so
+        # a figure built from an older dataset is rebuilt and a figure is only
+        # patched against what the browser really shows. The default view is
+        # served from the snapshot, so this must not load the dataset.
+        current_filters = [selected_countries, start_year, end_year, known_fingerprint()]
+        if rendered_filters == current_filters:
+            raise PreventUpdate
+
+        try:
+            figure = build_tab_figure(tab, selected_countries, start_year, end_year)
+        except RuntimeError:
+            # The figure pool logged why. No filters are stored, so showing
+            # the tab again retries the build.
+            return placeholder_figure("This chart could not be built. Try again or change the filters."), None
+        if config.PREFETCH_TABS:
+            prefetch_tabs(tab, selected_countries, start_year, end_year)
+        if tab in PATCHED_TABS and rendered_filters and rendered_filters[3:] == current_filters[3:]:
+            # Send only what changed since the figure the browser shows, when
+            # that figure is still in the cache to compare against
+            rendered = figure_cache.get(cache_key(tab, *rendered_filters[:3]))
+            patch = figure_patch(json.loads(rendered), figure) if rendered is not None else None
+            if patch is not None:
+                return patch, current_filters
+        return figure, current_filters
+
+
+def register_clientside_tab_callback(tab, graph_id):
+
+    # The figure is filtered and assembled in the browser from the client-data store
+    app.clientside_callback(
+        ClientsideFunction(namespace='co2_filters', function_name=CLIENTSIDE_TABS[tab]),
+        Output(graph_id, 'figure'),
+        [Input('tabs', 'value'),
+         Input('country-dropdown', 'value'),
+         Input('start-year-input', 'value'),
+         Input('end-year-input', 'value'),
+         Input('client-data', 'data')]
+    )
+
+
+for tab, (graph_id, _) in TAB_FIGURES.items():
+    if tab in SERVER_TABS:
+        register_tab_callback(tab, graph_id)
+    else:
+        register_clientside_tab_callback(tab, graph_id)
+
+
+# Ranked correlation table for multi-country selections, read from the
+# correlation engine's precomputed sums
+@app.callback(
+    [Output('correlation-table', 'data'),
+     Output('correlation-ranking', 'style')],
+    [Input('tabs', 'value'),
+     Input('country-dropdown', 'value'),
+     Input('start-year-input', 'value'),
+     Input('end-year-input', 'value'),
+     Input('dataset-version', 'data')]
+)
+def update_correlation_table(active_tab, selected_countries, start_year, end_year, _):
+    if active_tab != 'correlation':
+        raise PreventUpdate
+
+    style = {'width': '80%', 'margin-top': '20px'}
+    selected_countries, _, _ = figure_filters(selected_countries, start_year, end_year)
+    if selected_countries == 'all':
+        selected_countries = None
+    # A region stands for its member countries, so a single region is already
+    # several countries
+    if selected_countries is not None:
+        selected_countries = expand_selection(selected_countries)
+    if selected_countries is not None and len(selected_countries) < 2:
+        return [], dict(style, display='none')
+
+    try:
+        start_year, end_year = int(start_year), int(end_year)
+    except (TypeError, ValueError):
+        return [], dict(style, display='none')
+
+    return ranked_correlations(get_index(), selected_countries, start_year, end_year), style
+
+
+# Rolling correlation of a single selected country, read from the correlation
+# engine's precomputed sums
+@app.callback(
+    [Output('rolling-correlation-graph', 'figure'),
+     Output('rolling-correlation', 'style')],
+    [Input('tabs', 'value'),
+     Input('country-dropdown', 'value'),
+     Input('start-year-input', 'value'),
+     Input('end-year-input', 'value'),
+     Input('dataset-version', 'data')]
+)
+def update_rolling_correlation(active_tab, selected_countries, start_year, end_year, _):
+    if active_tab != 'correlation':
+        raise PreventUpdate
+
+    style = {'width': '80%'}
+    selected_countries, _, _ = figure_filters(selected_countries, start_year, end_year)
+    if selected_countries is None or selected_countries == 'all':
+        return dash.no_update, dict(style, display='none')
+
+    # A region stands for its member countries
+    countries = expand_selection(selected_countries)
+    if len(countries) != 1:
+        return dash.no_update, dict(style, display='none')
+
+    try:
+        start_year, end_year = int(start_year), int(end_year)
+    except (TypeError, ValueError):
+        return dash.no_update, dict(style, display='none')
+
+    return create_rolling_correlation_figure(countries[0], start_year, end_year), style
+
+
+# Keep the download link on the current filters
+@app.callback(
+    Output('export-link', 'href'),
+    [Input('country-dropdown', 'value'),
+     Input('start-year-input', 'value'),
+     Input('end-year-input', 'value')],
+    prevent_initial_call=True
+)
+def update_export_link(selected_countries, start_year, end_year):
+    return export_url(selected_countries, start_year, end_year)
+
+
+# Clicking a region's line in the trend charts drills down into it: the world
+# into its continents, a continent or income group into its countries. The
+# charts filtered in the browser have no region lines, so client-side
+# filtering offers no regions and no drill-down.
+if not config.CLIENTSIDE_FILTERING:
+
+    @app.callback(
+        Output('country-dropdown', 'value'),
+        [Input('co2-emission-graph', 'clickData'),
+         Input('population-trend-graph', 'clickData')],
+        [State('country-dropdown', 'value'),
+         State('start-year-input', 'value'),
+         State('end-year-input', 'value')],
+        prevent_initial_call=True
+    )
+    def drill_into_region(co2_click, population_click, selected_countries, start_year, end_year):
+        triggered = dash.callback_context.triggered[0]
+        if not triggered['value']:
+            raise PreventUpdate
+        metric = 'co2' if triggered['prop_id'].startswith('co2-emission-graph') else 'population'
+
+        # The region lines come first in both charts
+        regions, _ = split_selection(selected_countries)
+        names = series_names(get_index(), metric, regions, start_year, end_year)
+        curve = triggered['value']['points'][0]['curveNumber']
+        if curve >= len(names):
+            raise PreventUpdate
+        return drill_down(names[curve])
+
+
+# Reload the dataset when its file changed since it was loaded, and tell the
+# page so the charts built from the old data are rebuilt
+@app.callback(
+    Output('dataset-version', 'data'),
+    [Input('data-poll', 'n_intervals')],
+    [State('dataset-version', 'data')],
+    prevent_initial_call=True
+)
+def update_dataset_version(_, current_version):
+    # A process that has not loaded the dataset yet has nothing to reload
+    if is_loaded():
+        reload_if_changed()
+    version = known_fingerprint()
+    if version == current_version:
+        raise PreventUpdate
+    return version
+
+
+if config.CLIENTSIDE_FILTERING:
+
+    # Send the compact dataset once per session, and again only after the
+    # dataset on disk changed
+    @app.callback(
+        Output('client-data', 'data'),
+        [Input('dataset-version', 'data')],
+        [State('client-data', 'data')]
+    )
+    def update_client_data(_, current_data):
+        if current_data and current_data.get('version') == dataset_fingerprint():
+            raise PreventUpdate
+        return client_payload()
+
+
+# Emission-sources year slider: frames are drawn in the browser from the packed
+# per-year values the server sends with the figure
+app.clientside_callback(
+    ClientsideFunction(namespace='co2_sources', function_name='showYear'),
+    [Output('co2-emission-sources-graph', 'figure', allow_duplicate=True),
+     Output('co2-sources-year-slider', 'min'),
+     Output('co2-sources-year-slider', 'max'),
+     Output('co2-sources-year-slider', 'value'),
+     Output('co2-sources-year-slider', 'marks')],
+    [Input('co2-sources-year-slider', 'value'),
+     Input('co2-sources-play-interval', 'n_intervals'),
+     Input('co2-emission-sources-graph', 'figure')],
+    prevent_initial_call=True
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='co2_sources', function_name='togglePlay'),
+    [Output('co2-sources-play-interval', 'disabled'),
+     Output('co2-sources-play-button', 'children')],
+    [Input('co2-sources-play-button', 'n_clicks')],
+    prevent_initial_call=True
+)
+
 
 if __name__ == '__main__':
     app.run_server(debug=True)
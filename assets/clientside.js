@@ -0,0 +1,246 @@
+/* Clientside callbacks (registered in app.py) */
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    co2_sources: {
+
+        /* Decode a base64 string of little-endian float32 values */
+        decodeFloat32: function(encoded) {
+            var bytes = Uint8Array.from(atob(encoded), function(c) { return c.charCodeAt(0); });
+            return new Float32Array(bytes.buffer);
+        },
+
+        /* Draw the emission-sources chart for one year from the packed values
+           the server put in layout.meta, or point the year slider at a newly
+           received figure */
+        showYear: function(sliderYear, nIntervals, figure) {
+            var noUpdate = window.dash_clientside.no_update;
+            var meta = figure && figure.layout && figure.layout.meta;
+            if (!meta || !meta.frame_years) {
+                return [noUpdate, noUpdate, noUpdate, noUpdate, noUpdate];
+            }
+
+            var years = meta.frame_years;
+            var triggered = window.dash_clientside.callback_context.triggered.map(function(t) { return t.prop_id; });
+
+            // A new figure arrived from the server: match the slider to its years
+            if (triggered.indexOf('co2-emission-sources-graph.figure') !== -1) {
+                var marks = {};
+                var step = Math.max(1, Math.ceil(years.length / 10));
+                for (var m = 0; m < years.length; m += step) {
+                    marks[years[m]] = String(years[m]);
+                }
+                marks[years[years.length - 1]] = String(years[years.length - 1]);
+                return [noUpdate, years[0], years[years.length - 1], meta.frame_year, marks];
+            }
+
+            // The play timer advances one year at a time, wrapping at the end
+            var position;
+            if (triggered.indexOf('co2-sources-play-interval.n_intervals') !== -1) {
+                position = (years.indexOf(meta.frame_year) + 1) % years.length;
+            } else {
+                // Snap to the closest year that has data
+                position = 0;
+                for (var i = 1; i < years.length; i++) {
+                    if (Math.abs(years[i] - sliderYear) < Math.abs(years[position] - sliderYear)) {
+                        position = i;
+                    }
+                }
+            }
+
+            var values = window.dash_clientside.co2_sources.decodeFloat32(meta.frame_values);
+            var sources = meta.frame_sources;
+            var data = figure.data.map(function(trace) {
+                var source = sources.indexOf(trace.name);
+                return Object.assign({}, trace, {x: [values[position * sources.length + source]]});
+            });
+            var layout = Object.assign({}, figure.layout, {
+                meta: Object.assign({}, meta, {frame_year: years[position]})
+            });
+
+            return [Object.assign({}, figure, {data: data, layout: layout}), noUpdate, noUpdate, years[position], noUpdate];
+        },
+
+        /* Start or stop the play timer */
+        togglePlay: function(nClicks) {
+            var playing = nClicks % 2 === 1;
+            return [!playing, playing ? 'Pause' : 'Play'];
+        }
+    },
+
+    /* Client-side filtering mode (config.CLIENTSIDE_FILTERING): the figures
+       below are built from the compact payload in the client-data dcc.Store */
+    co2_filters: {
+
+        /* Decoded arrays of the payload in use, keyed by its dataset version */
+        decoded: null,
+
+        decode: function(payload) {
+            var filters = window.dash_clientside.co2_filters;
+            if (filters.decoded && filters.decoded.version === payload.version) {
+                return filters.decoded;
+            }
+            var bytes = function(encoded) {
+                return Uint8Array.from(atob(encoded), function(c) { return c.charCodeAt(0); });
+            };
+            var decoded = {version: payload.version, present: bytes(payload.present), metrics: {}};
+            Object.keys(payload.metrics).forEach(function(name) {
+                decoded.metrics[name] = new Float32Array(bytes(payload.metrics[name]).buffer);
+            });
+            filters.decoded = decoded;
+            return decoded;
+        },
+
+        /* Country positions and year columns matching the filters. Country
+           names match case- and whitespace-insensitively, as on the server. */
+        select: function(payload, selectedCountries, startYear, endYear) {
+            var rows = [];
+            var all = !selectedCountries || selectedCountries === 'all' || selectedCountries.length === 0 ||
+                (selectedCountries.length === 1 && selectedCountries[0] === 'all');
+            if (typeof selectedCountries === 'string') {
+                selectedCountries = [selectedCountries];
+            }
+            var wanted = {};
+            if (!all) {
+                selectedCountries.forEach(function(name) { wanted[String(name).trim().toLowerCase()] = true; });
+            }
+            payload.countries.forEach(function(name, row) {
+                if (all || wanted[name.trim().toLowerCase()]) {
+                    rows.push(row);
+                }
+            });
+            return {
+                rows: rows,
+                first: Math.max(startYear, payload.first_year) - payload.first_year,
+                last: Math.min(endYear, payload.last_year) - payload.first_year,
+                width: payload.last_year - payload.first_year + 1
+            };
+        },
+
+        layout: function(title, xTitle, yTitle, bottomMargin) {
+            var axis = function(axisTitle, lineColor) {
+                return {
+                    title: {text: axisTitle, font: {color: 'black'}},
+                    tickfont: {color: 'black'},
+                    showgrid: false,
+                    linecolor: lineColor,
+                    linewidth: 2
+                };
+            };
+            return {
+                title: {text: title, x: 0.5, y: 0.95, font: {size: 24, color: 'black'}},
+                paper_bgcolor: 'white',
+                plot_bgcolor: 'white',
+                font: {color: 'black', family: 'Roboto, sans-serif'},
+                xaxis: axis(xTitle, 'gray'),
+                yaxis: axis(yTitle, 'black'),
+                legend: {title: {text: 'country'}},
+                margin: {l: 50, r: 50, t: 50, b: bottomMargin}
+            };
+        },
+
+        /* One series of (x, y, year) per selected country with data in range */
+        series: function(payload, selection, xMetric, yMetric) {
+            var data = window.dash_clientside.co2_filters.decode(payload);
+            var result = [];
+            selection.rows.forEach(function(row) {
+                var x = [], y = [], years = [];
+                for (var col = selection.first; col <= selection.last; col++) {
+                    var cell = row * selection.width + col;
+                    if (!data.present[cell]) {
+                        continue;
+                    }
+                    var year = payload.first_year + col;
+                    var yValue = data.metrics[yMetric][cell];
+                    x.push(xMetric ? data.metrics[xMetric][cell] : year);
+                    y.push(isNaN(yValue) ? null : yValue);
+                    years.push(year);
+                }
+                if (x.length) {
+                    result.push({name: payload.countries[row], x: x, y: y, years: years});
+                }
+            });
+            return result;
+        },
+
+        lineFigure: function(activeTab, tab, selectedCountries, startYear, endYear, payload, metric, title, yTitle) {
+            if (activeTab !== tab || !payload || startYear == null || endYear == null) {
+                return window.dash_clientside.no_update;
+            }
+            var filters = window.dash_clientside.co2_filters;
+            var selection = filters.select(payload, selectedCountries, startYear, endYear);
+            var traces = filters.series(payload, selection, null, metric).map(function(series) {
+                return {
+                    type: 'scatter', mode: 'lines', name: series.name, legendgroup: series.name,
+                    x: series.x, y: series.y, line: {width: 2}
+                };
+            });
+            return {data: traces, layout: filters.layout(title, 'Year', yTitle, 50)};
+        },
+
+        co2Trend: function(activeTab, selectedCountries, startYear, endYear, payload) {
+            return window.dash_clientside.co2_filters.lineFigure(
+                activeTab, 'co2-trend', selectedCountries, startYear, endYear, payload,
+                'co2', 'CO2 Emissions Over Time by Country', 'CO2 (in metric tons)');
+        },
+
+        populationTrend: function(activeTab, selectedCountries, startYear, endYear, payload) {
+            return window.dash_clientside.co2_filters.lineFigure(
+                activeTab, 'population-trend', selectedCountries, startYear, endYear, payload,
+                'population', 'Population Trend by Country', 'Population (in millions)');
+        },
+
+        correlation: function(activeTab, selectedCountries, startYear, endYear, payload) {
+            if (activeTab !== 'correlation' || !payload || startYear == null || endYear == null) {
+                return window.dash_clientside.no_update;
+            }
+            var filters = window.dash_clientside.co2_filters;
+            var selection = filters.select(payload, selectedCountries, startYear, endYear);
+            var series = filters.series(payload, selection, 'population', 'co2');
+            var single = selection.rows.length === 1;
+
+            var traces = series.map(function(s) {
+                return {
+                    type: 'scatter', mode: 'markers', name: s.name, showlegend: !single,
+                    x: s.x, y: s.y, customdata: s.years,
+                    hovertemplate: '<b>' + s.name + '</b><br>Year=%{customdata}<br>' +
+                        'Population=%{x}<br>CO2=%{y}<extra></extra>'
+                };
+            });
+            var layout = filters.layout('Correlation Between Population and CO2 Emissions',
+                'Population (in millions)', 'CO2 Emissions (in metric tons)', 100);
+
+            // Pearson coefficient when a single country is selected
+            if (single) {
+                var text = 'Insufficient data for correlation';
+                var s = series[0];
+                if (s && s.x.length > 1) {
+                    var n = 0, sx = 0, sy = 0, sxx = 0, syy = 0, sxy = 0;
+                    for (var i = 0; i < s.x.length; i++) {
+                        if (isNaN(s.x[i]) || s.y[i] === null) {
+                            continue;
+                        }
+                        n++; sx += s.x[i]; sy += s.y[i];
+                        sxx += s.x[i] * s.x[i]; syy += s.y[i] * s.y[i]; sxy += s.x[i] * s.y[i];
+                    }
+                    var corr = (n * sxy - sx * sy) / Math.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy));
+                    if (isFinite(corr)) {
+                        var interpretation = corr > 0.7 ? 'High Positive Correlation' :
+                            corr > 0.3 ? 'Low Positive Correlation' :
+                            corr > -0.3 ? 'No Correlation' :
+                            corr > -0.7 ? 'Low Negative Correlation' : 'High Negative Correlation';
+                        text = 'Correlation Coefficient = ' + corr.toFixed(2) + ' (' + interpretation + ')';
+                    } else {
+                        text = '';
+                    }
+                }
+                if (text) {
+                    layout.annotations = [{
+                        x: 0.5, y: -0.25, xref: 'paper', yref: 'paper', showarrow: false,
+                        text: text, font: {size: 12, color: 'black'}
+                    }];
+                }
+            }
+            return {data: traces, layout: layout};
+        }
+    }
+});
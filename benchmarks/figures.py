@@ -0,0 +1,188 @@
+# Benchmark the four figure builders on synthetic datasets of increasing size.
+#
+#   python -m benchmarks.figures --scales 1 10 100 --output results.json
+#   python -m benchmarks.figures --scales 1 --compare results.json
+#
+# For every scale and filter scenario the wall time (median of --repeat runs),
+# the peak memory allocated while building (tracemalloc) and the size of the
+# serialized figure are recorded. Results are written as JSON so runs from
+# different commits can be compared with --compare.
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import pandas as pd
+
+import data_store
+from benchmarks.synthetic import generate_csv, sample_countries
+from co2_data import cache_dir, memory_bytes
+from co2_population_corr import create_population_co2_correlation_figure
+from co2_sources import update_co2_sources_graph
+from co2_trend import create_co2_emission_trend_figure
+from figure_builder import figure_json
+from population_trend import create_population_trend_figure
+
+BUILDERS = {
+    'co2_trend': create_co2_emission_trend_figure,
+    'population_trend': create_population_trend_figure,
+    'correlation': create_population_co2_correlation_figure,
+    'co2_sources': update_co2_sources_graph,
+}
+
+# Year ranges used by every country scenario
+YEAR_RANGES = {
+    'wide': ("1750-01-01", "2023-12-31"),
+    'narrow': ("2000-01-01", "2023-12-31"),
+}
+
+# Rows parsed with every column to estimate the memory of a full default
+# parse; reading the whole file that way would need gigabytes at 100x
+FULL_MEMORY_SAMPLE_ROWS = 20000
+
+
+def scenarios(scale):
+    countries = {
+        'all': 'all',
+        'one_country': sample_countries(1, scale),
+        'twenty_countries': sample_countries(20, scale),
+    }
+    for country_name, selection in countries.items():
+        for range_name, (start_date, end_date) in YEAR_RANGES.items():
+            yield f"{country_name}/{range_name}", selection, start_date, end_date
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_load(path):
+    # Cold load parses the CSV and builds the binary cache; warm load reuses it
+    shutil.rmtree(cache_dir(path), ignore_errors=True)
+    started = time.perf_counter()
+    data_store.load(path)
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    data_store.load(path)
+    warm = time.perf_counter() - started
+
+    # Memory of every column as pandas parses it by default, against the
+    # registered columns in their compact dtypes that the store keeps. The
+    # default parse is measured on the first rows and scaled to the file's
+    # row count.
+    sample = pd.read_csv(path, nrows=FULL_MEMORY_SAMPLE_ROWS)
+    with open(path, 'rb') as f:
+        file_rows = sum(1 for _ in f) - 1
+    full_memory = memory_bytes(sample) * file_rows // max(len(sample), 1)
+
+    stats = data_store.load_stats()
+    return {'cold_seconds': cold, 'warm_seconds': warm, 'rows': stats['rows'],
+            'full_memory_bytes': full_memory, 'memory_bytes': stats['memory_bytes']}
+
+
+def measure_builder(builder, args, repeat):
+    # Peak memory from one traced run, then timings without tracing overhead
+    tracemalloc.start()
+    figure = builder(*args)
+    payload_bytes = len(figure_json(figure))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        builder(*args)
+        timings.append(time.perf_counter() - started)
+
+    return {
+        'seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'peak_memory_bytes': peak,
+        'payload_bytes': payload_bytes,
+    }
+
+
+def run(scales, repeat, data_dir):
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+
+    for scale in scales:
+        path = os.path.join(data_dir, f"owid-co2-synthetic-{scale}x.csv")
+        if not os.path.exists(path):
+            print(f"Generating {path} ...")
+            generate_csv(path, scale)
+
+        load = measure_load(path)
+        print(f"{scale:>4}x  load  {load['rows']:>9} rows  cold {load['cold_seconds']:.3f}s  "
+              f"warm {load['warm_seconds']:.3f}s  memory ~{load['full_memory_bytes'] / 1e6:.1f} MB -> "
+              f"{load['memory_bytes'] / 1e6:.1f} MB")
+        results.append(dict(scale=scale, builder='load', scenario='-', **load))
+
+        for scenario, selection, start_date, end_date in scenarios(scale):
+            for name, builder in BUILDERS.items():
+                measured = measure_builder(builder, (selection, start_date, end_date), repeat)
+                print(f"{scale:>4}x  {name:<17} {scenario:<24} {measured['seconds'] * 1000:9.1f} ms  "
+                      f"peak {measured['peak_memory_bytes'] / 1e6:8.1f} MB  "
+                      f"payload {measured['payload_bytes'] / 1e3:9.1f} KB")
+                results.append(dict(scale=scale, builder=name, scenario=scenario, **measured))
+
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(current, baseline):
+    # Print the time ratio of every measurement present in both runs
+    def keyed(run_results):
+        return {(r['scale'], r['builder'], r['scenario']): r for r in run_results['results']}
+
+    previous = keyed(baseline)
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for key, result in keyed(current).items():
+        if key not in previous:
+            continue
+        field = 'seconds' if 'seconds' in result else 'cold_seconds'
+        ratio = result[field] / previous[key][field] if previous[key][field] else float('nan')
+        flag = '  <-- slower' if ratio > 1.2 else ''
+        print(f"{key[0]:>4}x  {key[1]:<17} {key[2]:<24} {ratio:6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the four figure builders on synthetic datasets")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help="dataset sizes as multiples of the real row count")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per measurement")
+    parser.add_argument('--data-dir', default=os.path.join('benchmarks', 'data'),
+                        help="where the synthetic CSVs are generated and kept")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run(args.scales, args.repeat, args.data_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+# Load test: replay scripted dashboard sessions against a running server.
+#
+#   python -m benchmarks.load --sessions 20 --duration 60
+#   python -m benchmarks.load --url http://127.0.0.1:8050 --sessions 50 --think-time 0.5
+#
+# Without --url a server is started locally (the Flask development server, or
+# gunicorn with --server gunicorn) and stopped afterwards. Each session opens
+# the dashboard like a browser does, firing the callbacks of the initial page
+# load, then repeatedly picks a user action (adding or removing a country in
+# the dropdown, editing the start or end year, switching tabs), fires the
+# server callbacks that action triggers through /_dash-update-component and
+# waits an exponentially distributed think time. Throughput and the p50, p95
+# and p99 latency and response size of every callback are reported, and
+# written as JSON with --output.
+import argparse
+import gzip
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+# Dashboard inputs a user edits; the callbacks are found from the app's
+# /_dash-dependencies, so the script follows the app's callback graph
+DROPDOWN = ('country-dropdown', 'value')
+START_YEAR = ('start-year-input', 'value')
+END_YEAR = ('end-year-input', 'value')
+TABS = ('tabs', 'value')
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Relative frequency of each user action
+ACTIONS = {
+    'add_country': 3,
+    'remove_country': 2,
+    'edit_start_year': 2,
+    'edit_end_year': 1,
+    'switch_tab': 2,
+}
+
+
+class Client:
+    # Keep-alive HTTP connection of one session
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        # (status, decoded body, bytes on the wire, seconds)
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            started = time.perf_counter()
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                raw = response.read()
+            except (http.client.HTTPException, OSError):
+                # The server closed the idle connection: reconnect once
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+                continue
+            seconds = time.perf_counter() - started
+            data = gzip.decompress(raw) if response.getheader('Content-Encoding') == 'gzip' else raw
+            return response.status, data, len(raw), seconds
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+class Results:
+    # Latencies and sizes per callback, shared by the session threads
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, name, status, size, seconds):
+        with self.lock:
+            if status in (200, 204):
+                self.samples.setdefault(name, []).append((seconds, size, status))
+            else:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of a non-empty list
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+def find_props(layout):
+    # {(component id, property): value} of every component with an id
+    props = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and 'props' in node:
+            component_props = node['props']
+            if 'id' in component_props:
+                for prop, value in component_props.items():
+                    props[(component_props['id'], prop)] = value
+            stack.append(component_props.get('children'))
+    return props
+
+
+def server_callbacks(dependencies):
+    # The callbacks that run on the server, with their inputs, state and outputs
+    callbacks = []
+    for dependency in dependencies:
+        if dependency.get('clientside_function'):
+            continue
+        outputs = [output.split('@')[0].rsplit('.', 1) for output in dependency['output'].strip('.').split('...')]
+        callbacks.append({
+            'name': outputs[0][0],
+            'output': dependency['output'],
+            'outputs': [{'id': id_, 'property': prop} for id_, prop in outputs],
+            'inputs': [(item['id'], item['property']) for item in dependency['inputs']],
+            'state': [(item['id'], item['property']) for item in dependency['state']],
+            'initial': not dependency.get('prevent_initial_call'),
+        })
+    return callbacks
+
+
+class Session:
+    # One simulated user: the state of the page and the actions taken on it
+
+    def __init__(self, url, props, callbacks, countries, tabs, rng, results):
+        self.client = Client(url)
+        self.props = dict(props)
+        self.callbacks = callbacks
+        self.countries = countries
+        self.tabs = tabs
+        self.rng = rng
+        self.results = results
+
+    def fire(self, callback, changed):
+        body = {
+            'output': callback['output'],
+            'outputs': callback['outputs'] if len(callback['outputs']) > 1 else callback['outputs'][0],
+            'inputs': [{'id': id_, 'property': prop, 'value': self.props.get((id_, prop))}
+                       for id_, prop in callback['inputs']],
+            'changedPropIds': [f"{id_}.{prop}" for id_, prop in changed],
+            'state': [{'id': id_, 'property': prop, 'value': self.props.get((id_, prop))}
+                      for id_, prop in callback['state']],
+        }
+        status, data, size, seconds = self.client.request('POST', '/_dash-update-component', body)
+        self.results.add(callback['name'], status, size, seconds)
+
+        # Keep what the server sent (e.g. the per-tab filter stores) for the
+        # callbacks that read it as state. Partial updates are not applied:
+        # the harness never reads figures back.
+        if status == 200:
+            for id_, values in json.loads(data).get('response', {}).items():
+                for prop, value in values.items():
+                    if not (isinstance(value, dict) and '__dash_patch_update' in value):
+                        self.props[(id_, prop)] = value
+
+    def trigger(self, *changed):
+        # The browser fires every callback with a changed input
+        for callback in self.callbacks:
+            if any(prop in callback['inputs'] for prop in changed):
+                self.fire(callback, changed)
+
+    def open_page(self):
+        for path in ('/', '/_dash-layout', '/_dash-dependencies'):
+            status, _, size, seconds = self.client.request('GET', path)
+            self.results.add(f"GET {path}", status, size, seconds)
+        for callback in self.callbacks:
+            if callback['initial']:
+                self.fire(callback, [])
+
+    def act(self):
+        action = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        selected = self.props.get(DROPDOWN) or []
+        selected = [selected] if isinstance(selected, str) else [c for c in selected if c != 'all']
+        start, end = int(self.props.get(START_YEAR) or 1850), int(self.props.get(END_YEAR) or 2023)
+
+        if action == 'add_country' or (action == 'remove_country' and not selected):
+            self.props[DROPDOWN] = selected + [self.rng.choice(self.countries)]
+            self.trigger(DROPDOWN)
+        elif action == 'remove_country':
+            selected.remove(self.rng.choice(selected))
+            self.props[DROPDOWN] = selected or ['all']
+            self.trigger(DROPDOWN)
+        elif action == 'edit_start_year':
+            self.props[START_YEAR] = self.rng.randrange(1850, end)
+            self.trigger(START_YEAR)
+        elif action == 'edit_end_year':
+            self.props[END_YEAR] = self.rng.randrange(start + 1, 2024)
+            self.trigger(END_YEAR)
+        else:
+            tabs = [tab for tab in self.tabs if tab != self.props.get(TABS)]
+            self.props[TABS] = self.rng.choice(tabs)
+            self.trigger(TABS)
+
+    def run(self, deadline, think_time):
+        try:
+            self.open_page()
+            while time.monotonic() < deadline:
+                if think_time:
+                    time.sleep(min(self.rng.expovariate(1 / think_time), max(0.0, deadline - time.monotonic())))
+                if time.monotonic() >= deadline:
+                    break
+                self.act()
+        finally:
+            self.client.close()
+
+
+def tab_values(layout):
+    # Values of the dcc.Tab children of the tabs component
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and 'props' in node:
+            if node['props'].get('id') == TABS[0]:
+                return [tab['props']['value'] for tab in node['props']['children']]
+            stack.append(node['props'].get('children'))
+    return []
+
+
+def start_server(server, port, workers, threads):
+    # Start the dashboard on localhost and wait until it is ready
+    env = dict(os.environ, CO2_BIND=f"127.0.0.1:{port}", CO2_WORKERS=str(workers), CO2_THREADS=str(threads))
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:create_app()']
+    else:
+        command = [sys.executable, '-c',
+                   "from werkzeug.serving import run_simple; from wsgi import create_app; "
+                   f"run_simple('127.0.0.1', {port}, create_app(), threaded=True)"]
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    client = Client(f"http://127.0.0.1:{port}")
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with status {process.returncode}")
+        try:
+            if client.request('GET', '/readyz')[0] == 200:
+                client.close()
+                return process
+        except OSError:
+            pass
+        client.close()
+        client = Client(f"http://127.0.0.1:{port}")
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("The server did not become ready within 300s")
+
+
+def run(url, sessions, duration, think_time, seed):
+    setup = Client(url)
+    layout = json.loads(setup.request('GET', '/_dash-layout')[1])
+    callbacks = server_callbacks(json.loads(setup.request('GET', '/_dash-dependencies')[1]))
+    setup.close()
+
+    props = find_props(layout)
+    tabs = tab_values(layout)
+    countries = [option['value'] for option in props.get((DROPDOWN[0], 'options'), []) if option['value'] != 'all']
+
+    results = Results()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=Session(url, props, callbacks, countries, tabs, random.Random(seed + i),
+                                               results).run, args=(deadline, think_time))
+               for i in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for name, samples in sorted(results.samples.items()):
+        seconds = [s for s, _, _ in samples]
+        sizes = [size for _, size, _ in samples]
+        report[name] = {
+            'requests': len(samples),
+            'no_update': sum(1 for _, _, status in samples if status == 204),
+            'errors': results.errors.get(name, 0),
+            'p50_ms': percentile(seconds, 0.50) * 1000,
+            'p95_ms': percentile(seconds, 0.95) * 1000,
+            'p99_ms': percentile(seconds, 0.99) * 1000,
+            'mean_bytes': sum(sizes) / len(sizes),
+            'p95_bytes': percentile(sizes, 0.95),
+            'total_bytes': sum(sizes),
+        }
+    total = sum(len(samples) for samples in results.samples.values())
+    return {
+        'url': url,
+        'sessions': sessions,
+        'duration_seconds': elapsed,
+        'think_time_seconds': think_time,
+        'requests': total,
+        'errors': sum(results.errors.values()),
+        'throughput_rps': total / elapsed if elapsed else 0.0,
+        'callbacks': report,
+    }
+
+
+def print_report(results):
+    print(f"{results['sessions']} sessions for {results['duration_seconds']:.1f}s: "
+          f"{results['requests']} requests, {results['throughput_rps']:.1f} req/s, {results['errors']} errors")
+    print(f"{'callback':<34} {'requests':>8} {'204':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'mean KB':>9} {'p95 KB':>9}")
+    for name, stats in results['callbacks'].items():
+        print(f"{name:<34} {stats['requests']:>8} {stats['no_update']:>6} {stats['p50_ms']:9.1f} "
+              f"{stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f} {stats['mean_bytes'] / 1e3:9.1f} "
+              f"{stats['p95_bytes'] / 1e3:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay scripted dashboard sessions against a server")
+    parser.add_argument('--url', help="server to test; by default one is started on localhost")
+    parser.add_argument('--server', choices=['dev', 'gunicorn'], default='dev',
+                        help="server started without --url")
+    parser.add_argument('--port', type=int, default=8765, help="port of the server started without --url")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers of the started server")
+    parser.add_argument('--threads', type=int, default=4, help="gunicorn threads per worker of the started server")
+    parser.add_argument('--sessions', type=int, default=10, help="concurrent user sessions")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to run")
+    parser.add_argument('--think-time', type=float, default=1.0,
+                        help="mean pause in seconds between a session's actions (0 for none)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the session scripts")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if url is None:
+        process = start_server(args.server, args.port, args.workers, args.threads)
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        results = run(url.rstrip('/'), args.sessions, args.duration, args.think_time, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Synthetic datasets shaped like Our World in Data's owid-co2-data.csv, used to
+# measure how the dashboard scales with the number of rows.
+import os
+
+import numpy as np
+import pandas as pd
+
+# Columns of the OWID CO2 dataset
+OWID_COLUMNS = [
+    'country', 'year', 'iso_code', 'population', 'gdp', 'cement_co2', 'cement_co2_per_capita',
+    'co2', 'co2_growth_abs', 'co2_growth_prct', 'co2_including_luc', 'co2_including_luc_growth_abs',
+    'co2_including_luc_growth_prct', 'co2_including_luc_per_capita', 'co2_including_luc_per_gdp',
+    'co2_including_luc_per_unit_energy', 'co2_per_capita', 'co2_per_gdp', 'co2_per_unit_energy',
+    'coal_co2', 'coal_co2_per_capita', 'consumption_co2', 'consumption_co2_per_capita',
+    'consumption_co2_per_gdp', 'cumulative_cement_co2', 'cumulative_co2', 'cumulative_co2_including_luc',
+    'cumulative_coal_co2', 'cumulative_flaring_co2', 'cumulative_gas_co2', 'cumulative_luc_co2',
+    'cumulative_oil_co2', 'cumulative_other_co2', 'energy_per_capita', 'energy_per_gdp', 'flaring_co2',
+    'flaring_co2_per_capita', 'gas_co2', 'gas_co2_per_capita', 'ghg_excluding_lucf_per_capita',
+    'ghg_per_capita', 'land_use_change_co2', 'land_use_change_co2_per_capita', 'methane',
+    'methane_per_capita', 'nitrous_oxide', 'nitrous_oxide_per_capita', 'oil_co2', 'oil_co2_per_capita',
+    'other_co2_per_capita', 'other_industry_co2', 'primary_energy_consumption', 'share_global_cement_co2',
+    'share_global_co2', 'share_global_co2_including_luc', 'share_global_coal_co2',
+    'share_global_cumulative_cement_co2', 'share_global_cumulative_co2',
+    'share_global_cumulative_co2_including_luc', 'share_global_cumulative_coal_co2',
+    'share_global_cumulative_flaring_co2', 'share_global_cumulative_gas_co2',
+    'share_global_cumulative_luc_co2', 'share_global_cumulative_oil_co2',
+    'share_global_cumulative_other_co2', 'share_global_flaring_co2', 'share_global_gas_co2',
+    'share_global_luc_co2', 'share_global_oil_co2', 'share_global_other_co2', 'share_of_temperature_change_from_ghg',
+    'temperature_change_from_ch4', 'temperature_change_from_co2', 'temperature_change_from_ghg',
+    'temperature_change_from_n2o', 'total_ghg', 'total_ghg_excluding_lucf', 'trade_co2', 'trade_co2_share',
+]
+
+# The real file has about 255 entities over 1750-2023, roughly 50,000 rows
+BASE_ENTITIES = 255
+FIRST_YEAR = 1750
+LAST_YEAR = 2023
+
+# Source columns and their share of total CO2 in the synthetic data
+SOURCE_SHARES = {
+    'coal_co2': 0.40, 'oil_co2': 0.32, 'gas_co2': 0.20, 'cement_co2': 0.05, 'flaring_co2': 0.01,
+}
+
+
+def country_name(i):
+    return f"Synthetic Country {i:05d}"
+
+
+def _entity_rows(rng, i):
+    # One entity's rows: it enters the data between 1750 and 1950
+    first_year = int(rng.integers(FIRST_YEAR, 1951))
+    years = np.arange(first_year, LAST_YEAR + 1)
+    n = len(years)
+
+    growth = np.cumprod(1 + rng.normal(0.01, 0.005, n))
+    population = rng.uniform(1e5, 5e7) * growth
+    co2 = np.abs(rng.uniform(0.01, 5) * growth ** 1.5 + rng.normal(0, 0.1, n))
+    co2[rng.random(n) < 0.05] = np.nan
+
+    columns = {
+        'country': np.full(n, country_name(i), dtype=object),
+        'year': years,
+        # About one entity in twenty is an aggregate without an ISO code
+        'iso_code': np.full(n, np.nan if i % 20 == 19 else f"S{i:05d}", dtype=object),
+        'population': population,
+        'gdp': population * rng.uniform(500, 50000),
+        'co2': co2,
+    }
+    for source, share in SOURCE_SHARES.items():
+        columns[source] = co2 * share * rng.uniform(0.5, 1.5)
+    for name in OWID_COLUMNS:
+        if name not in columns:
+            columns[name] = np.where(rng.random(n) < 0.3, np.nan, rng.random(n))
+    return pd.DataFrame(columns, columns=OWID_COLUMNS)
+
+
+def generate_csv(path, scale=1, seed=0, chunk_entities=200):
+    # Write an OWID-shaped CSV with `scale` times the real number of entities.
+    # Entities are written in chunks so large scales never sit in memory.
+    rng = np.random.default_rng(seed)
+    entities = BASE_ENTITIES * scale
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, 'w', newline='') as f:
+        for start in range(0, entities, chunk_entities):
+            chunk = pd.concat([_entity_rows(rng, i) for i in range(start, min(start + chunk_entities, entities))])
+            chunk.to_csv(f, index=False, header=start == 0)
+    os.replace(tmp_path, path)
+    return path
+
+
+def sample_countries(count, scale=1):
+    # `count` country names spread evenly over the synthetic dataset, skipping
+    # the aggregates (which are dropped by clean_data)
+    entities = [i for i in range(BASE_ENTITIES * scale) if i % 20 != 19]
+    step = max(1, len(entities) // count)
+    return [country_name(i) for i in entities[::step][:count]]
@@ -0,0 +1,39 @@
+# Compact copy of the dataset for client-side filtering (config.CLIENTSIDE_FILTERING).
+# The browser receives the country and year axes plus each metric as a base64
+# float32 country x year array, and assets/clientside.js builds the trend,
+# population and correlation figures from it.
+import base64
+
+import numpy as np
+
+import config
+from co2_data import register_columns
+from data_store import dataset_fingerprint, get_derived, register_derived
+
+# Metrics the client-side figures need
+CLIENT_METRICS = ['co2', 'population']
+register_columns(__name__, CLIENT_METRICS)
+
+
+def _encode(array, dtype):
+    return base64.b64encode(np.ascontiguousarray(array, dtype=dtype).tobytes()).decode('ascii')
+
+
+def build_client_payload(co2_index):
+    return {
+        'countries': co2_index.countries.tolist(),
+        'first_year': co2_index.first_year,
+        'last_year': co2_index.last_year,
+        # Which cells have a row in the dataset, one byte per cell
+        'present': _encode(co2_index.present, '<u1'),
+        'metrics': {metric: _encode(co2_index.metrics[metric], '<f4') for metric in CLIENT_METRICS},
+    }
+
+
+if config.CLIENTSIDE_FILTERING:
+    register_derived('client_payload', build_client_payload)
+
+
+def client_payload():
+    # Payload for the dcc.Store, tagged with the dataset it was built from
+    return dict(get_derived('client_payload'), version=dataset_fingerprint())
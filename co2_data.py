@@ -1,12 +1,282 @@
-import pandas as pd 
+import hashlib
+import json
+import os
+import shutil
+import time
 
-def clean_data(file_path):
+import numpy as np
+import pandas as pd
 
-    # Load the dataset
-    df = pd.read_csv(file_path)
+# Bump whenever the on-disk cache layout changes
+CACHE_FORMAT = 2
 
-    # Cleaning the data. Removing non-country data. 
-    df_cleaned =df.dropna(subset=['iso_code']).copy()
+# Text columns kept as pandas categoricals: one small integer code per row
+# instead of a Python string object
+CATEGORICAL_COLUMNS = ['country', 'iso_code']
+
+# Columns every load needs: the record key and the country it belongs to
+KEY_COLUMNS = ['country', 'year', 'iso_code']
+
+# Decimal places tried when checking whether a float column fits in float32
+MAX_DECIMALS = 6
+
+# module -> columns of the dataset it reads. Only their union is loaded.
+_column_registry = {}
+
+
+def register_columns(owner, columns):
+    # Declare the dataset columns a module reads (at import time, before the
+    # first load)
+    _column_registry[owner] = list(columns)
+
+
+def required_columns():
+    # The key columns, then every registered column in registration order
+    columns = list(KEY_COLUMNS)
+    for owner_columns in _column_registry.values():
+        columns.extend(column for column in owner_columns if column not in columns)
+    return columns
+
+
+def _float32_decimals(values):
+    # Number of decimal places the float64 values were written with if storing
+    # them as float32 and rounding back to that many places restores every
+    # value exactly, otherwise None (e.g. populations above 2**24)
+    finite = values[np.isfinite(values)]
+    for decimals in range(MAX_DECIMALS + 1):
+        if np.array_equal(np.round(finite, decimals), finite):
+            restored = np.round(finite.astype(np.float32).astype(np.float64), decimals)
+            return decimals if np.array_equal(restored, finite) else None
+    return None
+
+
+def _compact(df):
+    # int16 years, and float32 for the float columns that survive the round
+    # trip; df.attrs['decimals'] remembers how to restore their exact values
+    df['year'] = df['year'].astype(np.int16)
+    decimals = {}
+    for column in df.columns:
+        if df[column].dtype != np.float64:
+            continue
+        column_decimals = _float32_decimals(df[column].to_numpy())
+        if column_decimals is not None:
+            df[column] = df[column].astype(np.float32)
+            decimals[column] = column_decimals
+    df.attrs['decimals'] = decimals
+    return df
+
+
+def column_values(df, column):
+    # float64 values of a metric column, exactly as written in the CSV even
+    # when the column is held as float32
+    values = df[column].to_numpy(dtype=np.float64)
+    decimals = df.attrs.get('decimals', {}).get(column)
+    return values if decimals is None else np.round(values, decimals)
+
+
+def memory_bytes(df):
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+
+def clean_data(file_path, timings=None, use_cache=True):
+
+    started = time.perf_counter()
+
+    # Serve the already-cleaned columns from the binary cache when it is still valid
+    df_cleaned = _read_cache(file_path) if use_cache else None
+    if df_cleaned is not None:
+        if timings is not None:
+            timings['cache'] = 'hit'
+            timings['read_seconds'] = time.perf_counter() - started
+            timings['clean_seconds'] = 0.0
+            timings['memory_bytes'] = memory_bytes(df_cleaned)
+        return df_cleaned
+
+    # Load the dataset, only the columns some module registered
+    usecols = set(required_columns())
+    df = pd.read_csv(file_path, usecols=lambda column: column in usecols)
+    read_seconds = time.perf_counter() - started
+
+    # Cleaning the data. Removing non-country data.
+    df_cleaned =df.dropna(subset=['iso_code']).reset_index(drop=True)
+    for column in CATEGORICAL_COLUMNS:
+        df_cleaned[column] = df_cleaned[column].astype('category')
+    df_cleaned = _compact(df_cleaned)
+
+    clean_seconds = time.perf_counter() - started - read_seconds
+
+    if use_cache:
+        _write_cache(file_path, df_cleaned)
+
+    # Report how long parsing and cleaning took, if the caller asked for it
+    if timings is not None:
+        timings['cache'] = 'miss' if use_cache else 'disabled'
+        timings['read_seconds'] = read_seconds
+        timings['clean_seconds'] = clean_seconds
+        timings['memory_bytes'] = memory_bytes(df_cleaned)
 
     return df_cleaned
 
+
+# Binary columnar cache
+#
+# The cleaned frame is stored next to the CSV as one .npy file per column in
+# "<csv>.cache/<id>/", described by "<csv>.cache/manifest.json". The id hashes
+# the CSV's SHA-256, the cache format and the loaded columns. Numeric
+# columns are memory-mapped on load, so every process reading the cache shares
+# the same page-cache pages instead of holding a private parsed copy. Text
+# columns are stored as integer codes plus a JSON list of their values. The
+# manifest lists the columns the cache was built with; a module registering a
+# column it lacks makes the next load read the CSV again.
+
+def cache_dir(file_path):
+    return f"{file_path}.cache"
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dataset_sha256(file_path):
+    # Content hash of the CSV, taken from a valid cache manifest when possible
+    manifest = _read_manifest(file_path)
+    if manifest is not None and _cache_is_valid(file_path, manifest):
+        return manifest['sha256']
+    return file_sha256(file_path)
+
+
+def _data_dir_name(sha256, usecols):
+    # Differs whenever the files in the directory would, so a directory left
+    # by another format or column set is never mistaken for this one
+    key = json.dumps([sha256, CACHE_FORMAT, usecols])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _read_manifest(file_path):
+    try:
+        with open(os.path.join(cache_dir(file_path), 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('format') != CACHE_FORMAT:
+        return None
+    return manifest
+
+
+def _write_manifest(file_path, manifest):
+    # Write to a temporary file first so readers never see a half-written manifest
+    path = os.path.join(cache_dir(file_path), 'manifest.json')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def _cache_is_valid(file_path, manifest):
+    stat = os.stat(file_path)
+    if manifest['size'] == stat.st_size and manifest['mtime_ns'] == stat.st_mtime_ns:
+        return True
+
+    # Size or mtime changed (e.g. the file was copied or checked out again):
+    # the cache is still usable if the content hash is the same
+    if manifest['size'] == stat.st_size and manifest['sha256'] == file_sha256(file_path):
+        manifest['mtime_ns'] = stat.st_mtime_ns
+        try:
+            _write_manifest(file_path, manifest)
+        except OSError:
+            pass
+        return True
+
+    return False
+
+
+def _read_cache(file_path):
+    manifest = _read_manifest(file_path)
+    if manifest is None or not set(required_columns()) <= set(manifest['usecols']):
+        return None
+    if not _cache_is_valid(file_path, manifest):
+        return None
+
+    data_dir = os.path.join(cache_dir(file_path), manifest['data_dir'])
+    columns = {}
+    decimals = {}
+    try:
+        for i, column in enumerate(manifest['columns']):
+            values = np.load(os.path.join(data_dir, f"{i}.npy"), mmap_mode='r')
+            if column['kind'] == 'text':
+                with open(os.path.join(data_dir, f"{i}.json")) as f:
+                    labels = json.load(f)
+                if column['name'] in CATEGORICAL_COLUMNS:
+                    # The stored codes are the categorical's codes (-1 is missing)
+                    values = pd.Categorical.from_codes(values, categories=labels)
+                else:
+                    # Code -1 (missing) picks the trailing NaN
+                    values = np.array(labels + [np.nan], dtype=object)[values]
+            elif column.get('decimals') is not None:
+                decimals[column['name']] = column['decimals']
+            columns[column['name']] = values
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # copy=False keeps the numeric columns backed by the memory maps
+    df = pd.DataFrame(columns, copy=False)
+    df.attrs['decimals'] = decimals
+    return df
+
+
+def _write_cache(file_path, df):
+    stat = os.stat(file_path)
+    sha256 = file_sha256(file_path)
+    root = cache_dir(file_path)
+    usecols = sorted(required_columns())
+    data_dir_name = _data_dir_name(sha256, usecols)
+    data_dir = os.path.join(root, data_dir_name)
+    tmp_dir = f"{data_dir}.{os.getpid()}.tmp"
+
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        columns = []
+        for i, name in enumerate(df.columns):
+            series = df[name]
+            if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+                np.save(os.path.join(tmp_dir, f"{i}.npy"), series.to_numpy())
+                columns.append({'name': name, 'kind': 'numeric', 'decimals': df.attrs.get('decimals', {}).get(name)})
+            else:
+                codes, labels = pd.factorize(series, sort=True)
+                np.save(os.path.join(tmp_dir, f"{i}.npy"), codes.astype(np.int32))
+                with open(os.path.join(tmp_dir, f"{i}.json"), 'w') as f:
+                    json.dump([str(label) for label in labels], f)
+                columns.append({'name': name, 'kind': 'text'})
+
+        # Another process may have built the same cache in the meantime
+        if os.path.isdir(data_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            os.replace(tmp_dir, data_dir)
+
+        _write_manifest(file_path, {
+            'format': CACHE_FORMAT,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': sha256,
+            'data_dir': data_dir_name,
+            'rows': len(df),
+            # The columns requested when the cache was built, including
+            # registered ones the CSV does not have
+            'usecols': usecols,
+            'columns': columns,
+        })
+    except OSError:
+        # A read-only data directory just means running without a cache
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+
+    # Remove caches built for earlier versions of the file or other columns
+    for entry in os.listdir(root):
+        path = os.path.join(root, entry)
+        if len(entry) == 64 and entry != data_dir_name and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
@@ -1,72 +1,74 @@
-import pandas as pd
-import plotly.express as px
-from co2_data import clean_data
+import numpy as np
+from co2_data import register_columns
+from correlation import interpret_correlation, rolling_correlation, window_correlation
+from data_store import get_index
+from figure_builder import group_series, line_figure, message_figure, scatter_figure
+from metrics import PhaseTimer, observe_rows
+from rollups import expand_selection
+
+register_columns(__name__, ['co2', 'population'])
+
+# Years in each window of the rolling correlation chart
+ROLLING_WINDOW_YEARS = 20
 
 def create_population_co2_correlation_figure(selected_countries, start_date, end_date):
 
-    # Load and clean the data
-    co2_data = clean_data("owid-co2-data.csv")
+    # Dense country x year arrays of the dataset
+    timer = PhaseTimer('correlation')
+    co2_index = get_index()
+    timer.mark('load')
 
     # Check if start_date and end_date are None (or empty)
     if start_date is None or end_date is None:
-        return px.bar(
-            title="Please select a valid date range.",
-            labels={"emissions": "Total Emissions", "year": "Year"}
-        )
+        return message_figure("Please select a valid date range.")
 
     # Ensure valid date range format (YYYY-MM-DD) and convert to year integer
     try:
         start_year = int(start_date[:4])
         end_year = int(end_date[:4])
     except ValueError:
-        return px.bar(
-            title="Invalid date range selected.",
-            labels={"emissions": "Total Emissions", "year": "Year"}
-        )
-
-    co2_data = co2_data[co2_data['year'].between(start_year, end_year)]
+        return message_figure("Invalid date range selected.")
 
     # Handle the case where no country is selected (None or empty)
     if not selected_countries or selected_countries == 'all':
-        selected_countries = co2_data['country'].unique()  # Default to all countries
+        selected_countries = co2_index.countries  # Default to all countries
     else:
         if isinstance(selected_countries, str):
             selected_countries = [selected_countries]
+        # A selected region stands for its member countries
+        selected_countries = expand_selection(selected_countries)
+
+    # Filter data for the selected countries and date range
+    co2_data = co2_index.to_frame(['population', 'co2'], selected_countries, start_year, end_year)
 
-    # Filter data for the selected countries
-    co2_data = co2_data[co2_data['country'].isin(selected_countries)]
+    observe_rows('correlation', len(co2_data))
+    timer.mark('filter')
 
-    # Calculate correlation coefficient if a single country is selected
+    # Correlation coefficient if a single country is selected, read from the
+    # precomputed prefix sums of the correlation engine
     correlation_text = ""
     if len(selected_countries) == 1:
-        # Calculate correlation coefficient
-        if len(co2_data) > 1:  # Ensure there are enough data points
-            corr = co2_data['population'].corr(co2_data['co2'])
-            if corr is not None:
-                if corr > 0.7:
-                    interpretation = "High Positive Correlation"
-                elif corr > 0.3:
-                    interpretation = "Low Positive Correlation"
-                elif corr > -0.3:
-                    interpretation = "No Correlation"
-                elif corr > -0.7:
-                    interpretation = "Low Negative Correlation"
-                else:
-                    interpretation = "High Negative Correlation"
-                correlation_text = f"Correlation Coefficient = {corr:.2f} ({interpretation})"
+        rows = co2_index.country_positions(selected_countries)
+        corr, _ = window_correlation(co2_index, rows, start_year, end_year)
+        if len(corr) and np.isfinite(corr[0]):
+            correlation_text = f"Correlation Coefficient = {corr[0]:.2f} ({interpret_correlation(corr[0])})"
         else:
             correlation_text = "Insufficient data for correlation"
 
-    # Create scatter plot
-    fig = px.scatter(
-        co2_data,
-        x="population",
-        y="co2",
-        color="country" if len(selected_countries) > 1 else None,
-        hover_name="country" if len(selected_countries) > 1 else None,
+    # Create scatter plot, one trace per country when several are selected
+    several = len(selected_countries) > 1
+    if several:
+        series = group_series(co2_data, 'country', 'population', 'co2', 'year')
+    else:
+        series = [('', co2_data['population'].to_numpy(), co2_data['co2'].to_numpy(), co2_data['year'].to_numpy())]
+    fig = scatter_figure(
+        series,
         title="Correlation Between Population and CO2 Emissions",
-        labels={"population": "Population (in millions)", "co2": "CO2 Emissions (in metric tons)"},
-        hover_data=["year"]
+        x_label="Population (in millions)",
+        y_label="CO2 Emissions (in metric tons)",
+        legend_title="country",
+        hover_label="year",
+        legend=several,
     )
 
     # Add correlation text annotation if applicable
@@ -76,30 +78,27 @@ def create_population_co2_correlation_figure(selected_countries, start_date, end
             text=correlation_text, font=dict(size=12, color="black"),
         )
 
-    # Customize plot layout for better presentation
-    fig.update_layout(
-        title=dict(
-            text="Correlation Between Population and CO2 Emissions",
-            x=0.5, y=0.95, font=dict(size=24, color="black")
-        ),
-        paper_bgcolor='white',
-        font=dict(color="black", family="Roboto, sans-serif"),
-        plot_bgcolor='white',
-        xaxis=dict(
-            tickfont=dict(color="black"),
-            title_font=dict(color="black"),
-            showgrid=False,
-            linecolor="gray",
-            linewidth=2,
-        ),
-        yaxis=dict(
-            tickfont=dict(color="black"),
-            title_font=dict(color="black"),
-            showgrid=False,
-            linecolor="black",
-            linewidth=2,
-        ),
-        margin=dict(l=50, r=50, t=50, b=100),
-    )
+    # Room below the plot for the annotation
+    fig.update_layout(margin=dict(b=100))
+
+    timer.mark('figure')
+    return fig
 
+
+def create_rolling_correlation_figure(country, start_year, end_year):
+    # Population-CO2 coefficient of one country over a trailing window of
+    # ROLLING_WINDOW_YEARS years, one point per window end year
+    years, corr = rolling_correlation(get_index(), [country], ROLLING_WINDOW_YEARS, start_year, end_year)
+    if not np.isfinite(corr).any():
+        return message_figure(f"Not enough data for a {ROLLING_WINDOW_YEARS}-year rolling correlation")
+
+    # Windows without a coefficient are left as gaps in the line
+    fig = line_figure(
+        [(country, years, np.round(corr, 3))],
+        title=f"{ROLLING_WINDOW_YEARS}-Year Rolling Correlation for {country}",
+        x_label="year",
+        y_label="Correlation Coefficient",
+        legend_title="country",
+    )
+    fig.update_layout(yaxis_range=[-1.05, 1.05], showlegend=False)
     return fig
@@ -1,140 +1,233 @@
+import base64
+
+import numpy as np
 import pandas as pd
-import plotly.express as px
-from co2_data import clean_data
 
-def update_co2_sources_graph(selected_country, start_date, end_date):
+import config
+from co2_data import register_columns
+from data_store import get_derived, get_index, register_derived
+from figure_builder import make_figure, message_figure
+from metrics import PhaseTimer, observe_rows
+from rollups import expand_selection
+
+# Emission sources shown in the chart
+SOURCE_COLUMNS = ['cement_co2', 'coal_co2', 'gas_co2', 'flaring_co2', 'oil_co2']
+register_columns(__name__, SOURCE_COLUMNS)
+
+SOURCE_COLORS = {
+    "coal_co2": "blue",
+    "cement_co2": "orange",
+    "flaring_co2": "yellow",
+    "gas_co2": "red",
+    "oil_co2": "green"
+}
+
+
+def build_source_aggregates(co2_index):
+    # Per-country source emissions (countries x years x sources, missing values
+    # counted as zero) and their world totals per year, computed once per load
+    by_country = np.stack([np.nan_to_num(co2_index.metrics[source]) for source in SOURCE_COLUMNS], axis=-1)
+    by_country.flags.writeable = False
+
+    world = by_country.sum(axis=0)
+    world.flags.writeable = False
+
+    return {'by_country': by_country, 'world': world}
+
+
+def update_source_aggregates(co2_index, aggregates, update):
+    # After an incremental refresh only the changed countries x years block of
+    # the per-country vectors and the world totals of the changed years are
+    # recomputed
+    block = np.ix_(update.rows, update.cols)
+    by_country = update.grow(aggregates['by_country'], 0.0)
+    by_country[block] = np.stack([np.nan_to_num(co2_index.metrics[source][block])
+                                  for source in SOURCE_COLUMNS], axis=-1)
+    by_country.flags.writeable = False
+
+    world = update.grow(aggregates['world'][None], 0.0)[0]
+    world[update.cols] = by_country[:, update.cols].sum(axis=0)
+    world.flags.writeable = False
+
+    return {'by_country': by_country, 'world': world}
+
+
+register_derived('co2_sources', build_source_aggregates, update_source_aggregates)
+
+
+def source_totals_frame(co2_index, selected_country, start_year, end_year):
+    # Long-form (year, source, emissions) totals for the selected countries,
+    # summed from the precomputed per-country vectors
+    aggregates = get_derived('co2_sources')
+    years = co2_index.year_slice(start_year, end_year)
+
+    if selected_country == 'all':
+        totals = aggregates['world'][years]
+        has_data = co2_index.present[:, years].any(axis=0)
+    else:
+        rows = co2_index.country_positions(selected_country)
+        totals = aggregates['by_country'][rows, years].sum(axis=0)
+        has_data = co2_index.present[rows, years].any(axis=0)
+
+    # Only years in which at least one selected country has a row
+    totals = totals[has_data]
+    return pd.DataFrame({
+        'year': np.repeat(co2_index.years[years][has_data], len(SOURCE_COLUMNS)),
+        'source': np.tile(SOURCE_COLUMNS, len(totals)),
+        'emissions': totals.ravel(),
+    })
+
 
-    # Load and clean the dataset
-    co2_data = clean_data("owid-co2-data.csv")
+def source_frames_payload(aggregated_data):
+    # Every year's source totals packed as little-endian float32 (years x
+    # sources, base64 encoded) for the browser to draw frames from
+    values = aggregated_data['emissions'].to_numpy(dtype='<f4')
+    years = aggregated_data['year'].unique().tolist()
+    return {
+        'frame_years': years,
+        'frame_year': years[0],
+        'frame_sources': SOURCE_COLUMNS,
+        'frame_values': base64.b64encode(values.tobytes()).decode('ascii'),
+    }
+
+
+def source_bars(values, year=None):
+    # One horizontal bar trace per source for one year's totals
+    year_hover = f"<br>Year={year}" if year is not None else ""
+    return [
+        {
+            'type': 'bar',
+            'orientation': 'h',
+            'name': source,
+            'legendgroup': source,
+            'offsetgroup': source,
+            'alignmentgroup': 'True',
+            'showlegend': True,
+            'textposition': 'auto',
+            'x': [float(value)],
+            'y': [source],
+            'ids': [source],
+            'marker': {'color': SOURCE_COLORS[source]},
+            'hovertemplate': f"CO2 Emission Sources=%{{y}}{year_hover}<br>Total Emissions (in metric tons)=%{{x}}<extra></extra>",
+        }
+        for source, value in zip(SOURCE_COLUMNS, values)
+    ]
+
+
+def update_co2_sources_graph(selected_country, start_date, end_date, frame_mode=None):
+
+    frame_mode = frame_mode or config.CO2_SOURCES_FRAME_MODE
+
+    # Dense country x year arrays of the dataset
+    timer = PhaseTimer('co2-sources')
+    co2_index = get_index()
+    timer.mark('load')
 
     # Check if start_date and end_date are None (or empty)
     if start_date is None or end_date is None:
-        return px.bar(
-            title="Please select a valid date range.",
-            labels={"emissions": "Total Emissions", "year": "Year"}
-        )
+        return message_figure("Please select a valid date range.")
 
     # Ensure valid date range format (YYYY-MM-DD) and convert to year integer
     try:
         start_year = int(start_date[:4])
         end_year = int(end_date[:4])
     except ValueError:
-        return px.bar(
-            title="Invalid date range selected.",
-            labels={"emissions": "Total Emissions", "year": "Year"}
-        )
-
-    # Prepare the dataset for the CO2 emission sources analysis
-    co2_sources_by_country = co2_data[['country', 'year', 'cement_co2', 'coal_co2', 'gas_co2', 'flaring_co2', 'oil_co2']]
-
-    # Aggregate CO2 sources by country
-    co2_sources_by_country = co2_sources_by_country.groupby(['country', 'year'], as_index=False)[['cement_co2', 'coal_co2', 'gas_co2', 'flaring_co2', 'oil_co2']].sum()
-
-    # Melt the dataframe for visualization
-    co2_source_melted = co2_sources_by_country.melt(
-        id_vars=['country', 'year'],
-        value_vars=['cement_co2', 'coal_co2', 'gas_co2', 'flaring_co2', 'oil_co2'],
-        var_name='source',
-        value_name='emissions'
-    )
-
-    # Filter the data based on the start and end dates
-    filtered_data = co2_source_melted[
-        (co2_source_melted['year'] >= start_year) & 
-        (co2_source_melted['year'] <= end_year)
-    ]
+        return message_figure("Invalid date range selected.")
+
+    # Handle 'all' selection (None also means every country)
+    if selected_country is None:
+        selected_country = 'all'
 
     if selected_country == 'all':
-        aggregated_data = filtered_data.groupby(['year', 'source'], as_index=False)['emissions'].sum()
         title = "CO2 Emission Sources (All Countries)"
     else:
         if not isinstance(selected_country, list):
             selected_country = [selected_country]
-        filtered_data = filtered_data[filtered_data['country'].str.strip().isin(selected_country)]
-        if filtered_data.empty:
-            return px.bar(
-                title="No Data Available for the Selected Filters",
-                labels={"emissions": "Total Emissions", "source": "CO2 Emission Sources"}
-            )
-        aggregated_data = filtered_data
-        title = f"CO2 Emission Sources for {', '.join(selected_country)}"
-
-    # Create the bar chart
-    fig = px.bar(
-        aggregated_data,
-        x='emissions',
-        y='source',
-        color='source',
-        animation_frame='year',
-        animation_group='source',
-        title=title,
-        labels={
-            "emissions": "Total Emissions (in metric tons)",
-            "source": "CO2 Emission Sources",
-            "year": "Year"
-        },
-        color_discrete_map={
-            "coal_co2": "blue",
-            "cement_co2": "orange",
-            "flaring_co2": "yellow",
-            "gas_co2": "red",
-            "oil_co2": "green"
-        }
-    )
-
-    # Customize layout for aesthetics and readability
-    fig.update_layout(
-        title=dict(
-            text=title,
-            x=0.5,  # Center the title
-            y=0.95,
-            font=dict(size=24, color="black")
-        ),
-        paper_bgcolor='white',
-        font=dict(color="black", family="Roboto, sans-serif"),
-        plot_bgcolor='white',
-        xaxis=dict(
-            title="Total Emissions (in metric tons)",
-            tickfont=dict(color="black"),
-            title_font=dict(color="black"),
-            showgrid=False,
-            linecolor="gray",
-            linewidth=2
-        ),
-        yaxis=dict(
-            title="CO2 Emission Sources",
-            tickfont=dict(color="black"),
-            title_font=dict(color="black"),
-            showgrid=False,
-            linecolor="gray",
-            linewidth=2,
-            categoryorder='total ascending'
-        ),
-        margin=dict(l=50, r=50, t=50, b=50),
-        updatemenus=[
+        # Names in the figure cache's order (sorted, without duplicates), so a
+        # cached figure has the same title whatever order they were picked in
+        title = f"CO2 Emission Sources for {', '.join(sorted({str(name).strip() for name in selected_country}))}"
+
+    # Source totals per year for the selected countries and date range. A
+    # selected region stands for its member countries.
+    if selected_country != 'all':
+        selected_country = expand_selection(selected_country)
+    aggregated_data = source_totals_frame(co2_index, selected_country, start_year, end_year)
+
+    observe_rows('co2-sources', len(aggregated_data))
+    timer.mark('filter')
+
+    if aggregated_data.empty:
+        return message_figure("No Data Available for the Selected Filters")
+
+    # Source totals as a years x sources array (the frame is year-major)
+    years = aggregated_data['year'].to_numpy()[::len(SOURCE_COLUMNS)]
+    totals = aggregated_data['emissions'].to_numpy().reshape(len(years), len(SOURCE_COLUMNS))
+
+    layout = {
+        'title': {'text': title},
+        'xaxis': {'title': {'text': "Total Emissions (in metric tons)"}},
+        'yaxis': {'title': {'text': "CO2 Emission Sources"}, 'linecolor': "gray",
+                  'categoryorder': 'total ascending'},
+        'legend': {'title': {'text': "CO2 Emission Sources"}},
+        'barmode': 'relative',
+    }
+
+    if frame_mode == 'compact':
+        # Only the first year is drawn here; the other years travel as a packed
+        # array in layout.meta and are drawn client-side (assets/clientside.js)
+        layout['meta'] = source_frames_payload(aggregated_data)
+        # Keep the axis fixed while moving through the years
+        layout['xaxis']['range'] = [0, float(totals.max()) * 1.05 or 1]
+        fig = make_figure(source_bars(totals[0]), layout)
+        timer.mark('figure')
+        return fig
+
+    # One plotly animation frame per year, a year slider and Play/Pause buttons
+    frames = [{'name': str(year), 'data': source_bars(values, year)} for year, values in zip(years, totals)]
+    layout['sliders'] = [{
+        'active': 0,
+        'currentvalue': {'prefix': "Year="},
+        'len': 0.9,
+        'pad': {'b': 10, 't': 60},
+        'steps': [
             {
-                "buttons": [
-                    {
-                        "args": [None, {"frame": {"duration": 500, "redraw": True}, "fromcurrent": True}],
-                        "label": "Play",
-                        "method": "animate",
-                    },
-                    {
-                        "args": [[None], {"frame": {"duration": 0, "redraw": True}, "mode": "immediate", "transition": {"duration": 0}}],
-                        "label": "Pause",
-                        "method": "animate",
-                    },
-                ],
-                "direction": "left",
-                "pad": {"r": 10, "t": 10},
-                "showactive": True,
-                "type": "buttons",
-                "x": 0.1,
-                "xanchor": "right",
-                "y": -0.37,  # Adjusted to align with the year slider
-                "yanchor": "bottom",
+                'args': [[frame['name']], {"frame": {"duration": 0, "redraw": True}, "mode": "immediate",
+                                           "fromcurrent": True, "transition": {"duration": 0, "easing": "linear"}}],
+                'label': frame['name'],
+                'method': 'animate',
             }
-        ]
-    )
+            for frame in frames
+        ],
+        'x': 0.1,
+        'xanchor': 'left',
+        'y': 0,
+        'yanchor': 'top',
+    }]
+    layout['updatemenus'] = [
+        {
+            "buttons": [
+                {
+                    "args": [None, {"frame": {"duration": 500, "redraw": True}, "fromcurrent": True}],
+                    "label": "Play",
+                    "method": "animate",
+                },
+                {
+                    "args": [[None], {"frame": {"duration": 0, "redraw": True}, "mode": "immediate", "transition": {"duration": 0}}],
+                    "label": "Pause",
+                    "method": "animate",
+                },
+            ],
+            "direction": "left",
+            "pad": {"r": 10, "t": 10},
+            "showactive": True,
+            "type": "buttons",
+            "x": 0.1,
+            "xanchor": "right",
+            "y": -0.37,  # Adjusted to align with the year slider
+            "yanchor": "bottom",
+        }
+    ]
 
+    fig = make_figure(frames[0]['data'], layout, frames)
+    timer.mark('figure')
     return fig
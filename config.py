@@ -0,0 +1,69 @@
+import os
+
+# Dashboard settings. Every value can be overridden through an environment
+# variable so the same code runs on a laptop and behind a production server.
+
+# Path to the Our World in Data CO2 dataset
+DATA_FILE = os.environ.get("CO2_DATA_FILE", "owid-co2-data.csv")
+
+# Country -> continent and income group mapping (iso_code, continent,
+# income_group columns) the regional rollups are built from
+REGIONS_FILE = os.environ.get("CO2_REGIONS_FILE", os.path.join(os.path.dirname(__file__), "regions.csv"))
+
+# Upper bound on the serialized size of all figures kept by figure_cache
+FIGURE_CACHE_MAX_BYTES = int(os.environ.get("CO2_FIGURE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# How the emission-sources chart delivers its per-year frames:
+# "compact" sends the first year plus a packed array of every year's values and
+# redraws in the browser as the year slider moves; "full" embeds one plotly
+# animation frame per year.
+CO2_SOURCES_FRAME_MODE = os.environ.get("CO2_SOURCES_FRAME_MODE", "compact")
+
+# Line charts switch from SVG to WebGL traces above this many points in total
+WEBGL_POINT_THRESHOLD = int(os.environ.get("CO2_WEBGL_POINT_THRESHOLD", 5000))
+
+# Optionally reduce each line series with LTTB to about one point per pixel of
+# plot width (PLOT_WIDTH_PX); off by default
+DOWNSAMPLE_LINES = os.environ.get("CO2_DOWNSAMPLE_LINES", "0").lower() in ("1", "true", "yes")
+PLOT_WIDTH_PX = int(os.environ.get("CO2_PLOT_WIDTH_PX", 1000))
+
+# Ship the metrics to the browser once per session and filter the trend,
+# population and correlation charts there instead of on the server
+CLIENTSIDE_FILTERING = os.environ.get("CO2_CLIENTSIDE_FILTERING", "0").lower() in ("1", "true", "yes")
+
+# How often an open page asks the server to check the dataset file for changes;
+# the visible charts are rebuilt when it changed
+DATA_POLL_SECONDS = float(os.environ.get("CO2_DATA_POLL_SECONDS", 600))
+
+# Callbacks slower than this many seconds are logged with their filter
+# arguments; 0 turns the slow-request log off
+SLOW_REQUEST_SECONDS = float(os.environ.get("CO2_SLOW_REQUEST_SECONDS", 1.0))
+
+# Pool figures are built in concurrently, the default tabs during warmup and
+# the hidden tabs of a view in the background with PREFETCH_TABS: "thread",
+# "process" (workers mapping the dataset's binary cache) or "off" to build them
+# one after another and only on request. A request waits at most
+# FIGURE_TIMEOUT_SECONDS for a background build before building the figure
+# itself.
+FIGURE_POOL = os.environ.get("CO2_FIGURE_POOL", "thread")
+FIGURE_POOL_WORKERS = int(os.environ.get("CO2_FIGURE_POOL_WORKERS", 4))
+FIGURE_TIMEOUT_SECONDS = float(os.environ.get("CO2_FIGURE_TIMEOUT_SECONDS", 10.0))
+
+# Build the other tabs of a view in the figure pool after the visible one, so
+# switching tabs is answered from the figure cache. Off by default: hidden tabs
+# are otherwise only built when they are shown, instead of after every filter
+# change.
+PREFETCH_TABS = os.environ.get("CO2_PREFETCH_TABS", "0").lower() in ("1", "true", "yes")
+
+# Coalesce identical concurrent figure requests: "thread" shares one
+# computation between the threads of a worker, "process" also between the
+# workers of a server (through lock files in the dataset's cache directory,
+# where results are kept SINGLE_FLIGHT_RESULT_SECONDS), "off" computes every
+# request on its own
+SINGLE_FLIGHT = os.environ.get("CO2_SINGLE_FLIGHT", "thread")
+SINGLE_FLIGHT_RESULT_SECONDS = float(os.environ.get("CO2_SINGLE_FLIGHT_RESULT_SECONDS", 5.0))
+
+# Production server (gunicorn.conf.py)
+SERVER_BIND = os.environ.get("CO2_BIND", "0.0.0.0:8050")
+SERVER_WORKERS = int(os.environ.get("CO2_WORKERS", 2 * (os.cpu_count() or 1) + 1))
+SERVER_THREADS = int(os.environ.get("CO2_THREADS", 4))
@@ -0,0 +1,135 @@
+# Population-CO2 correlation engine. Prefix sums of x, y, x^2, y^2 and xy along
+# the year axis are computed for every country once per load, so the Pearson
+# coefficient of any country over any year window costs O(1).
+import numpy as np
+
+from co2_data import register_columns
+from data_store import get_derived, register_derived
+
+register_columns(__name__, ['co2', 'population'])
+
+
+def _correlation_sums(co2_index, rows):
+    x = co2_index.metrics['population'][rows]
+    y = co2_index.metrics['co2'][rows]
+
+    # Years in which both values are known
+    valid = co2_index.present[rows] & np.isfinite(x) & np.isfinite(y)
+
+    # Centre each country's values on its own mean to keep the sums of squares
+    # small and the variance (a difference of two sums) precise
+    counts = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(counts > 0, np.where(valid, x, 0).sum(axis=1) / counts, 0)
+        y_mean = np.where(counts > 0, np.where(valid, y, 0).sum(axis=1) / counts, 0)
+    xc = np.where(valid, x - x_mean[:, None], 0)
+    yc = np.where(valid, y - y_mean[:, None], 0)
+
+    def prefix(values):
+        sums = np.zeros((values.shape[0], values.shape[1] + 1))
+        np.cumsum(values, axis=1, out=sums[:, 1:])
+        return sums
+
+    return {
+        'n': prefix(valid.astype(np.float64)),
+        'x': prefix(xc),
+        'y': prefix(yc),
+        'xx': prefix(xc * xc),
+        'yy': prefix(yc * yc),
+        'xy': prefix(xc * yc),
+    }
+
+
+def build_correlation_sums(co2_index):
+    sums = _correlation_sums(co2_index, slice(None))
+    for values in sums.values():
+        values.flags.writeable = False
+    return sums
+
+
+def update_correlation_sums(co2_index, sums, update):
+    # After an incremental refresh the changed countries' sums are recomputed
+    # (their means may have moved). The other countries have no records in the
+    # years the axis grew by, so their prefix sums are 0 before and flat after.
+    changed = _correlation_sums(co2_index, update.rows)
+    updated = {}
+    for name, values in sums.items():
+        values = np.pad(values, [(0, 0), (update.years_before, 0)])
+        values = np.pad(values, [(0, 0), (0, update.years_after)], mode='edge')
+        values[update.rows] = changed[name]
+        values.flags.writeable = False
+        updated[name] = values
+    return updated
+
+
+register_derived('correlation', build_correlation_sums, update_correlation_sums)
+
+
+def _pearson(n, sx, sy, sxx, syy, sxy):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        corr = cov / np.sqrt(var_x * var_y)
+    # Fewer than two points or a constant series has no coefficient
+    return np.where((n >= 2) & (var_x > 0) & (var_y > 0), np.clip(corr, -1, 1), np.nan)
+
+
+def window_correlation(co2_index, rows, start_year=None, end_year=None):
+    # Pearson coefficient and number of years used, per row position, over
+    # the given year window
+    sums = get_derived('correlation')
+    years = co2_index.year_slice(start_year, end_year)
+    start, stop = years.start, years.stop
+
+    window = {name: values[rows, stop] - values[rows, start] for name, values in sums.items()}
+    corr = _pearson(window['n'], window['x'], window['y'], window['xx'], window['yy'], window['xy'])
+    return corr, window['n'].astype(np.int64)
+
+
+def rolling_correlation(co2_index, country, window_years, start_year=None, end_year=None):
+    # Coefficient over a trailing window of window_years years for one country.
+    # Returns the window end years and the coefficients.
+    sums = get_derived('correlation')
+    rows = co2_index.country_positions(country)
+    years = co2_index.year_slice(start_year, end_year)
+    if not len(rows) or years.stop - years.start < window_years:
+        return np.array([], dtype=np.int64), np.array([])
+
+    row = rows[0]
+    ends = np.arange(years.start + window_years, years.stop + 1)
+    starts = ends - window_years
+    window = {name: values[row, ends] - values[row, starts] for name, values in sums.items()}
+    corr = _pearson(window['n'], window['x'], window['y'], window['xx'], window['yy'], window['xy'])
+    return co2_index.years[ends - 1], corr
+
+
+def interpret_correlation(corr):
+    if corr > 0.7:
+        return "High Positive Correlation"
+    elif corr > 0.3:
+        return "Low Positive Correlation"
+    elif corr > -0.3:
+        return "No Correlation"
+    elif corr > -0.7:
+        return "Low Negative Correlation"
+    return "High Negative Correlation"
+
+
+def ranked_correlations(co2_index, countries=None, start_year=None, end_year=None):
+    # Rows of (country, coefficient, years, interpretation) for the selected
+    # countries, strongest positive correlation first. Countries without a
+    # coefficient are left out.
+    rows = co2_index.country_positions(countries)
+    corr, counts = window_correlation(co2_index, rows, start_year, end_year)
+
+    order = np.argsort(-np.nan_to_num(corr, nan=-np.inf), kind='stable')
+    return [
+        {
+            'country': co2_index.countries[rows[i]],
+            'correlation': round(float(corr[i]), 3),
+            'years': int(counts[i]),
+            'interpretation': interpret_correlation(corr[i]),
+        }
+        for i in order if np.isfinite(corr[i])
+    ]
@@ -0,0 +1,234 @@
+# Dense country x year representation of the cleaned dataset. Each metric is a
+# contiguous 2-D array (one row per country, one column per year), so selecting
+# some countries over a year range is fancy indexing plus a slice instead of a
+# boolean mask over every row of the frame.
+import copy
+
+import numpy as np
+import pandas as pd
+
+from co2_data import KEY_COLUMNS, column_values
+
+
+# Other names people use for countries, in normalized form -> the dataset's name
+COUNTRY_ALIASES = {
+    'usa': 'United States',
+    'us': 'United States',
+    'united states of america': 'United States',
+    'america': 'United States',
+    'uk': 'United Kingdom',
+    'great britain': 'United Kingdom',
+    'britain': 'United Kingdom',
+    'russian federation': 'Russia',
+    'south korea': 'South Korea',
+    'republic of korea': 'South Korea',
+    'korea': 'South Korea',
+    'north korea': 'North Korea',
+    'czech republic': 'Czechia',
+    'holland': 'Netherlands',
+    'burma': 'Myanmar',
+    'ivory coast': "Cote d'Ivoire",
+    'drc': 'Democratic Republic of Congo',
+    'dr congo': 'Democratic Republic of Congo',
+    'congo-kinshasa': 'Democratic Republic of Congo',
+    'congo-brazzaville': 'Congo',
+    'turkiye': 'Turkey',
+    'türkiye': 'Turkey',
+    'uae': 'United Arab Emirates',
+    'swaziland': 'Eswatini',
+    'macedonia': 'North Macedonia',
+    'cape verde': 'Cape Verde',
+    'east timor': 'East Timor',
+    'timor-leste': 'East Timor',
+    'vatican': 'Vatican',
+    'viet nam': 'Vietnam',
+    'iran, islamic republic of': 'Iran',
+    'syrian arab republic': 'Syria',
+    'lao pdr': 'Laos',
+}
+
+
+def normalize_name(name):
+    return ' '.join(str(name).split()).lower()
+
+
+class IndexUpdate:
+    # Part of the country x year grid an incremental refresh changed: the row
+    # positions and year columns (on the new axis) holding new or revised
+    # records, and how many years the year axis grew by at either end
+
+    def __init__(self, record_rows, record_years, years_before, years_after, first_year):
+        self.record_rows = record_rows
+        self.record_years = record_years
+        self.records = len(record_years)
+        self.rows = np.unique(record_rows)
+        self.cols = np.unique(record_years - first_year)
+        self.first_year = int(record_years.min())
+        self.last_year = int(record_years.max())
+        self.years_before = years_before
+        self.years_after = years_after
+
+    def overlaps(self, rows=None, start_year=None, end_year=None):
+        # Whether any changed record is in the given row positions (None is
+        # every country) and year range
+        changed = np.ones(self.records, dtype=bool)
+        if rows is not None:
+            changed &= np.isin(self.record_rows, rows)
+        if start_year is not None:
+            changed &= self.record_years >= start_year
+        if end_year is not None:
+            changed &= self.record_years <= end_year
+        return bool(changed.any())
+
+    def grow(self, values, fill=np.nan):
+        # Writable copy of a countries x years (x ...) array built before the
+        # update, padded to the new year axis
+        pad = [(0, 0)] * values.ndim
+        pad[1] = (self.years_before, self.years_after)
+        return np.pad(values, pad, constant_values=fill)
+
+
+class CountryYearIndex:
+
+    def __init__(self, df, metrics=None):
+        # Country axis, in the dataset's alphabetical order. The row of every
+        # record is its country's categorical code, so no strings are compared.
+        country = df['country'].astype('category').cat.remove_unused_categories()
+        country = country.cat.reorder_categories(sorted(country.cat.categories))
+        self.countries = np.array(country.cat.categories, dtype=object)
+        rows = country.cat.codes.to_numpy().astype(np.intp)
+
+        # ISO code of each country, from its first record
+        _, first_rows = np.unique(rows, return_index=True)
+        self.iso_codes = np.asarray(df['iso_code'], dtype=object)[first_rows]
+
+        # Year axis, one column per year between the first and last year
+        years = df['year'].to_numpy().astype(np.int64)
+        self.first_year = int(years.min()) if len(years) else 0
+        self.last_year = int(years.max()) if len(years) else -1
+        self.years = np.arange(self.first_year, self.last_year + 1)
+        cols = years - self.first_year
+
+        shape = (len(self.countries), len(self.years))
+
+        # Cells that have a row in the dataset (a row can still hold NaN metrics)
+        self.present = np.zeros(shape, dtype=bool)
+        self.present[rows, cols] = True
+
+        # One array per loaded metric column (the columns the figure modules
+        # registered), unless given
+        if metrics is None:
+            metrics = [column for column in df.columns if column not in KEY_COLUMNS]
+        self.metrics = {}
+        for metric in metrics:
+            if metric not in df.columns:
+                continue
+            values = np.full(shape, np.nan)
+            values[rows, cols] = column_values(df, metric)
+            self.metrics[metric] = values
+
+        self._freeze()
+
+        # Exact names, and normalized names, ISO codes and aliases -> row position.
+        # Dataset names win over ISO codes, which win over aliases.
+        self._positions = {name: i for i, name in enumerate(self.countries)}
+        self.country_codes = {}
+        for alias, name in COUNTRY_ALIASES.items():
+            if name in self._positions:
+                self.country_codes[alias] = self._positions[name]
+        for i, iso_code in enumerate(self.iso_codes):
+            if isinstance(iso_code, str) and iso_code:
+                self.country_codes[normalize_name(iso_code)] = i
+        for i, name in enumerate(self.countries):
+            self.country_codes[normalize_name(name)] = i
+
+    def _freeze(self):
+        # The arrays are shared by every request, so guard them against writes
+        self.present.flags.writeable = False
+        for values in self.metrics.values():
+            values.flags.writeable = False
+
+    def updated(self, df):
+        # Copy of the index with the records in df (new or revised rows) written
+        # over it, and the IndexUpdate describing which cells changed. Returns
+        # None when df has countries that are not on the country axis, since
+        # inserting one shifts every row position and needs a full rebuild.
+        rows = pd.Index(self.countries).get_indexer(np.asarray(df['country'], dtype=object))
+        if (rows < 0).any():
+            return None
+
+        years = df['year'].to_numpy().astype(np.int64)
+        first_year = min(self.first_year, int(years.min()))
+        last_year = max(self.last_year, int(years.max()))
+        cols = years - first_year
+        update = IndexUpdate(rows, years, self.first_year - first_year, last_year - self.last_year, first_year)
+
+        # The current arrays may be in use by other requests, so the new
+        # index gets patched copies and this one is left untouched
+        index = copy.copy(self)
+        index.first_year = first_year
+        index.last_year = last_year
+        index.years = np.arange(first_year, last_year + 1)
+
+        index.present = update.grow(self.present, False)
+        index.present[rows, cols] = True
+
+        index.metrics = {}
+        for metric, values in self.metrics.items():
+            values = update.grow(values)
+            values[rows, cols] = column_values(df, metric)
+            index.metrics[metric] = values
+
+        index._freeze()
+        return index, update
+
+    def country_code(self, name):
+        # Row position of one country given by name, ISO code or alias, or None
+        position = self._positions.get(name)
+        if position is None:
+            position = self.country_codes.get(normalize_name(name))
+        return position
+
+    def country_positions(self, countries=None):
+        # Row positions for the given country names, in axis order. None selects
+        # every country; names that are not in the dataset are ignored.
+        if countries is None:
+            return np.arange(len(self.countries))
+        if isinstance(countries, str):
+            countries = [countries]
+
+        positions = {self.country_code(name) for name in countries}
+        positions.discard(None)
+        return np.array(sorted(positions), dtype=np.intp)
+
+    def year_slice(self, start_year=None, end_year=None):
+        # Column slice for the years in [start_year, end_year], clipped to the axis
+        start = 0 if start_year is None else int(start_year) - self.first_year
+        stop = len(self.years) if end_year is None else int(end_year) - self.first_year + 1
+        start = min(max(start, 0), len(self.years))
+        stop = min(max(stop, start), len(self.years))
+        return slice(start, stop)
+
+    def select(self, metric, countries=None, start_year=None, end_year=None):
+        # 2-D block of one metric: selected countries x years in range
+        rows = self.country_positions(countries)
+        return self.metrics[metric][rows, self.year_slice(start_year, end_year)]
+
+    def to_frame(self, metrics, countries=None, start_year=None, end_year=None):
+        # Long-form frame (country, year, *metrics) holding only the cells that
+        # exist in the dataset, ordered by country and year like the source CSV
+        rows = self.country_positions(countries)
+        years = self.year_slice(start_year, end_year)
+
+        present = self.present[rows, years]
+        row_idx, col_idx = np.nonzero(present)
+
+        # Countries as a categorical over the selected names, built from the
+        # row codes instead of repeating the name strings
+        frame = {
+            'country': pd.Categorical.from_codes(row_idx, categories=self.countries[rows]),
+            'year': self.years[years][col_idx],
+        }
+        for metric in metrics:
+            frame[metric] = self.metrics[metric][rows, years][row_idx, col_idx]
+        return pd.DataFrame(frame)
@@ -0,0 +1,330 @@
+# Process-wide store for the cleaned dataset. The CSV is parsed once into a
+# dense country x year index that every figure builder reads from.
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+import config
+from co2_data import clean_data, dataset_sha256, required_columns
+from data_index import CountryYearIndex
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+# Held by the refresh that is parsing the file, so concurrent checks do not
+# parse it again; readers never take it
+_refresh_lock = threading.RLock()
+
+# name -> function(index) computing data derived from the index at every load
+_derived_builders = {}
+# name -> function(index, previous, update) patching derived data after an
+# incremental refresh; derived data without one is rebuilt
+_derived_updaters = {}
+
+# Incremental refreshes remembered for caches that catch up on what changed
+MAX_CHANGES = 64
+
+_state = {
+    "data": None,
+    "index": None,
+    "derived": {},
+    "row_keys": None,
+    "row_hashes": None,
+    # (version, IndexUpdate) of recent incremental refreshes
+    "changes": deque(maxlen=MAX_CHANGES),
+    "path": None,
+    "file_size": None,
+    "file_mtime": None,
+    "version": 0,
+    "sha256": None,
+    # Columns requested by the modules registered at the last load
+    "columns": None,
+    "stats": {},
+}
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _row_hashes(data):
+    # One hash per record identifying it by (iso_code, year), and one of its
+    # full contents, to tell appended and revised rows from unchanged ones
+    keys = pd.util.hash_pandas_object(data[["iso_code", "year"]], index=False).to_numpy()
+    hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+    return keys, hashes
+
+
+def load(path=None):
+    # (Re)load the dataset from disk, replacing whatever is currently stored
+    path = path or _state["path"] or config.DATA_FILE
+
+    with _lock:
+        file_size, file_mtime = _file_signature(path)
+
+        timings = {}
+        started = time.perf_counter()
+        data = clean_data(path, timings=timings)
+        load_seconds = time.perf_counter() - started
+        _install(_prepare(path, data, (file_size, file_mtime), timings, load_seconds))
+
+    logger.info("Loaded %s: %d rows in %.3fs (parse %.3fs)",
+                path, len(data), load_seconds, timings.get("read_seconds", 0.0))
+    return data
+
+
+def _prepare(path, data, signature, timings, load_seconds, row_hashes=None, previous=None, index=None,
+             update=None):
+    # State for a freshly read frame. Without an index the index and all
+    # derived data are built from scratch; with one (from an incremental
+    # refresh) the previous derived data are patched where an updater is
+    # registered.
+    sha256 = dataset_sha256(path)
+    row_keys, row_hashes = row_hashes or _row_hashes(data)
+
+    started = time.perf_counter()
+    if index is None:
+        index = CountryYearIndex(data)
+    index_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    derived = {}
+    for name, build in _derived_builders.items():
+        if update is not None and name in _derived_updaters and name in previous:
+            derived[name] = _derived_updaters[name](index, previous[name], update)
+        else:
+            derived[name] = build(index)
+    derived_seconds = time.perf_counter() - started
+
+    return {
+        "data": data,
+        "index": index,
+        "derived": derived,
+        "row_keys": row_keys,
+        "row_hashes": row_hashes,
+        "path": path,
+        "file_size": signature[0],
+        "file_mtime": signature[1],
+        "sha256": sha256,
+        "columns": required_columns(),
+        "update": update,
+        "stats": {
+            "path": path,
+            "sha256": sha256,
+            "rows": len(data),
+            "columns": len(data.columns),
+            "memory_bytes": timings.get("memory_bytes"),
+            "cache": timings.get("cache"),
+            "read_seconds": timings.get("read_seconds"),
+            "clean_seconds": timings.get("clean_seconds"),
+            "load_seconds": load_seconds,
+            "index_seconds": index_seconds,
+            "derived_seconds": derived_seconds,
+            "refresh": "full" if update is None else "incremental",
+            "changed_rows": len(data) if update is None else update.records,
+            "loaded_at": time.time(),
+        },
+    }
+
+
+def _install(prepared):
+    # Swap in the state _prepare() built; the caller holds _lock
+    update = prepared.pop("update")
+    version = _state["version"] + 1
+    if update is None:
+        _state["changes"].clear()
+    else:
+        _state["changes"].append((version, update))
+    _state.update(prepared, version=version)
+
+
+def refresh(path=None):
+    # Re-read the dataset and apply only what changed: records whose
+    # (iso_code, year) is new or whose contents differ are written into a
+    # copy of the index, and derived data are patched for the affected
+    # countries and years. Removed records, new countries or a different
+    # set of columns fall back to a full load. Returns the IndexUpdate, or
+    # None after a full load or when nothing changed.
+    #
+    # The file is parsed and compared, and the new state built, without
+    # holding _lock, so figures keep being served from the current data
+    # meanwhile. The lock is only taken to swap the new state in, which is
+    # skipped when another load or refresh got there first.
+    path = path or _state["path"] or config.DATA_FILE
+
+    with _refresh_lock:
+        return _refresh(path)
+
+
+def _refresh(path):
+    with _lock:
+        if _state["index"] is None or path != _state["path"]:
+            load(path)
+            return None
+        current_state = dict(_state)
+
+    signature = _file_signature(path)
+    timings = {}
+    started = time.perf_counter()
+    data = clean_data(path, timings=timings)
+    load_seconds = time.perf_counter() - started
+
+    row_keys, row_hashes = _row_hashes(data)
+    previous = pd.Series(current_state["row_hashes"], index=current_state["row_keys"])
+    current = pd.Series(row_hashes, index=row_keys)
+
+    update = None
+    if (list(data.columns) != list(current_state["data"].columns)
+            or not previous.index.is_unique or not current.index.is_unique
+            or not previous.index.isin(current.index).all()):
+        logger.info("Full reload of %s: records were removed or the columns changed", path)
+        prepared = _prepare(path, data, signature, timings, load_seconds, (row_keys, row_hashes))
+    else:
+        changed = previous.reindex(current.index).to_numpy() != current.to_numpy()
+        if not changed.any():
+            # Same records (e.g. the file was only touched)
+            with _lock:
+                if _state["version"] == current_state["version"]:
+                    _state.update(file_size=signature[0], file_mtime=signature[1])
+            return None
+
+        result = current_state["index"].updated(data[changed])
+        if result is None:
+            logger.info("Full reload of %s: new countries", path)
+            prepared = _prepare(path, data, signature, timings, load_seconds, (row_keys, row_hashes))
+        else:
+            index, update = result
+            prepared = _prepare(path, data, signature, timings, load_seconds, (row_keys, row_hashes),
+                                current_state["derived"], index, update)
+
+    with _lock:
+        if _state["version"] != current_state["version"]:
+            logger.info("Dropped the refresh of %s: the dataset was reloaded meanwhile", path)
+            return None
+        _install(prepared)
+
+    if update is not None:
+        logger.info("Refreshed %s: %d changed rows in %d countries, %d-%d",
+                    path, update.records, len(update.rows), update.first_year, update.last_year)
+    return update
+
+
+def reload_if_changed():
+    # Refresh only when the source file's size or modification time changed.
+    # Returns True when the file was re-read.
+    with _refresh_lock:
+        with _lock:
+            if _state["data"] is None:
+                load()
+                return True
+            if _file_signature(_state["path"]) == (_state["file_size"], _state["file_mtime"]):
+                return False
+        refresh()
+        return True
+
+
+def _needs_load():
+    # Not loaded yet, or loaded before a module registered the columns it reads
+    return _state["data"] is None or not set(required_columns()) <= set(_state["columns"])
+
+
+def get_index():
+    # Dense country x year arrays of the dataset, loading it on first use
+    with _lock:
+        if _needs_load():
+            load()
+        return _state["index"]
+
+
+def register_derived(name, build, update=None):
+    # Register data computed once per load from the index, e.g. aggregates a
+    # figure builder would otherwise recompute on every request. update, if
+    # given, patches the previous value after an incremental refresh instead.
+    with _lock:
+        _derived_builders[name] = build
+        if update is not None:
+            _derived_updaters[name] = update
+        if _state["index"] is not None:
+            _state["derived"][name] = build(_state["index"])
+
+
+def get_derived(name):
+    with _lock:
+        if _needs_load():
+            load()
+        return _state["derived"][name]
+
+
+def data_path():
+    # CSV the store loads (or has loaded) the dataset from
+    return _state["path"] or config.DATA_FILE
+
+
+def is_loaded():
+    return _state["data"] is not None
+
+
+def dataset_version():
+    # Incremented on every (re)load and refresh; derived caches compare against it
+    return _state["version"]
+
+
+def changes_since(version):
+    # IndexUpdates of the incremental refreshes after the given version, or
+    # None when a full load happened since (or is too old to tell)
+    with _lock:
+        if version is None:
+            return None
+        changes = [update for changed_version, update in _state["changes"] if changed_version > version]
+        if len(changes) != _state["version"] - version:
+            return None
+        return changes
+
+
+def dataset_fingerprint():
+    # SHA-256 of the loaded CSV. Unlike dataset_version() it is the same in
+    # every process that loaded the same file.
+    with _lock:
+        if _state["data"] is None:
+            load()
+        return _state["sha256"]
+
+
+def known_fingerprint():
+    # dataset_fingerprint() without loading the dataset: the file's SHA-256,
+    # read from its cache manifest when that is valid, until it is loaded.
+    # None when there is no file to read.
+    with _lock:
+        if _state["data"] is not None:
+            return _state["sha256"]
+    try:
+        return dataset_sha256(data_path())
+    except OSError:
+        return None
+
+
+def load_stats():
+    return dict(_state["stats"])
+
+
+def _collect_metrics():
+    stats = load_stats()
+    if not stats:
+        return {}
+    return {
+        'co2_dashboard_dataset_rows': ('gauge', "Rows in the loaded dataset.", stats['rows']),
+        'co2_dashboard_dataset_load_seconds': ('gauge', "Time the last dataset load took.",
+                                               f"{stats['load_seconds']:.6f}"),
+        'co2_dashboard_dataset_version': ('gauge', "Number of times the dataset was loaded.", dataset_version()),
+        'co2_dashboard_dataset_memory_bytes': ('gauge', "Memory held by the loaded dataset's columns.",
+                                               stats['memory_bytes'] or 0),
+    }
+
+
+register_collector('data_store', _collect_metrics)
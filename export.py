@@ -0,0 +1,165 @@
+# Data export: GET /export streams the numbers behind the current filters.
+#
+#   /export?countries=China&countries=India&start=1990&end=2020&format=csv
+#
+# Regions are exported as their member countries and 'all' (or no countries)
+# as every country. The rows are read from the index and written a few
+# countries at a time, so an all-countries export never exists in memory as a
+# whole. CSV is gzip-compressed on the fly when the client accepts it; Parquet
+# (with the optional pyarrow) is compressed by its own format. The ETag hashes
+# the dataset's SHA-256 and the normalized filters, so a repeated download of
+# an unchanged view is answered with 304 Not Modified.
+import hashlib
+import zlib
+
+from flask import Response, request
+
+from data_store import dataset_fingerprint, get_index
+from figure_cache import cache_key
+from rollups import expand_selection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only CSV exports are offered without it
+    pa = None
+    pq = None
+
+# Countries read from the index and written per chunk (or Parquet row group)
+EXPORT_CHUNK_COUNTRIES = 25
+
+FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def export_etag(export_format, selected_countries, start_year, end_year, encoding=None):
+    # Same dataset, filters, format and encoding: same bytes, same ETag
+    key = cache_key(export_format, selected_countries, start_year, end_year)
+    return hashlib.sha256(repr((dataset_fingerprint(), key, encoding)).encode()).hexdigest()[:32]
+
+
+def _export_countries(co2_index, selected_countries):
+    # Country names in index order; regions replaced by their members
+    if not selected_countries or selected_countries == ['all']:
+        return co2_index.countries.tolist()
+    positions = co2_index.country_positions(expand_selection(selected_countries))
+    return co2_index.countries[positions].tolist()
+
+
+def export_frames(selected_countries, start_year=None, end_year=None):
+    # Long-form frames (country, year, every loaded metric), a few countries
+    # each; a single empty frame when nothing matches, so the columns are
+    # still written
+    co2_index = get_index()
+    metrics = list(co2_index.metrics)
+    countries = _export_countries(co2_index, selected_countries)
+    empty = True
+    for start in range(0, len(countries), EXPORT_CHUNK_COUNTRIES):
+        frame = co2_index.to_frame(metrics, countries[start:start + EXPORT_CHUNK_COUNTRIES], start_year, end_year)
+        if not frame.empty:
+            empty = False
+            yield frame
+    if empty:
+        yield co2_index.to_frame(metrics, [], start_year, end_year)
+
+
+def _csv_chunks(frames):
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header).encode()
+        header = False
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _ChunkSink:
+    # Write-only file for ParquetWriter whose contents are drained per row group
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_chunks(frames):
+    sink = _ChunkSink()
+    writer = None
+    for frame in frames:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def _years(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def register_export_routes(server):
+
+    @server.route('/export')
+    def export_data():
+        export_format = request.args.get('format', 'csv')
+        if export_format not in FORMATS:
+            return {'error': f"Unknown format {export_format!r}; use csv or parquet"}, 400
+        if export_format == 'parquet' and pq is None:
+            return {'error': "Parquet export needs pyarrow, which is not installed"}, 501
+
+        selected_countries = request.args.getlist('countries') or ['all']
+        start_year, end_year = _years(request.args.get('start')), _years(request.args.get('end'))
+
+        encoding = 'gzip' if export_format == 'csv' and 'gzip' in request.accept_encodings else None
+        etag = export_etag(export_format, selected_countries, start_year, end_year, encoding)
+        headers = {
+            # Revalidate every time: the ETag makes an unchanged export a 304
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding',
+        }
+        if request.if_none_match.contains(etag):
+            response = Response(status=304, headers=headers)
+            response.set_etag(etag)
+            return response
+
+        frames = export_frames(selected_countries, start_year, end_year)
+        if export_format == 'parquet':
+            chunks = _parquet_chunks(frames)
+        else:
+            chunks = _csv_chunks(frames)
+            if encoding == 'gzip':
+                chunks = _gzip_chunks(chunks)
+                headers['Content-Encoding'] = 'gzip'
+
+        headers['Content-Disposition'] = f'attachment; filename="co2-data.{export_format}"'
+        response = Response(chunks, mimetype=FORMATS[export_format], headers=headers)
+        response.set_etag(etag)
+        return response
@@ -0,0 +1,141 @@
+# Lean figure construction shared by the four charts. Traces are built straight
+# from numpy arrays into go.Figure with property validation turned off (every
+# value is produced here, so it is known to be valid), and the common styling
+# lives in one registered plotly template instead of a per-chart update_layout.
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+try:
+    import orjson
+except ImportError:  # optional: plotly's json-module encoder is used instead
+    orjson = None
+
+# Encoder for figure JSON. orjson writes the numpy arrays of the traces natively.
+JSON_ENGINE = 'orjson' if orjson is not None else 'json'
+
+# Trace colors, in the order plotly express assigns them
+PALETTE = ['#636efa', '#EF553B', '#00cc96', '#ab63fa', '#FFA15A',
+           '#19d3f3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52']
+
+# Scatter charts switch to WebGL above this many points, like plotly express'
+# render_mode='auto'
+SCATTER_WEBGL_POINTS = 1000
+
+TEMPLATE = 'co2_dashboard'
+
+_axis = dict(
+    tickfont=dict(color="black"),
+    title_font=dict(color="black"),
+    showgrid=False,
+    linecolor="gray",
+    linewidth=2,
+)
+
+# Light background, black Roboto text, centred title, bordered axes without grid
+pio.templates[TEMPLATE] = go.layout.Template(
+    pio.templates['plotly'],
+    layout=dict(
+        title=dict(x=0.5, y=0.95, font=dict(size=24, color="black")),
+        paper_bgcolor='white',
+        plot_bgcolor='white',
+        font=dict(color="black", family="Roboto, sans-serif"),
+        xaxis=_axis,
+        yaxis=dict(_axis, linecolor="black"),
+        legend=dict(tracegroupgap=0),
+        margin=dict(l=50, r=50, t=50, b=50),
+    ),
+)
+
+# Without validation a template name is not resolved, so figures embed the
+# template's contents directly
+_template = pio.templates[TEMPLATE].to_plotly_json()
+
+
+def make_figure(data, layout, frames=None):
+    # go.Figure from trace and layout dicts, styled with the dashboard template
+    layout = dict(layout, template=_template)
+    return go.Figure(data=data, layout=layout, frames=frames, _validate=False)
+
+
+def message_figure(title):
+    # Empty chart that only shows a message, e.g. for an invalid date range
+    return make_figure([], {'title': {'text': title}})
+
+
+def figure_json(figure):
+    return pio.to_json(figure, validate=False, engine=JSON_ENGINE)
+
+
+def group_series(frame, group, x, y, *extra):
+    # (name, x, y, *extra) arrays for each series of a long-form frame whose
+    # rows are grouped by series, as CountryYearIndex.to_frame returns them
+    if frame.empty:
+        return []
+    groups = frame[group]
+    codes = groups.cat.codes.to_numpy() if hasattr(groups, 'cat') else groups.to_numpy()
+    boundaries = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(frame)]))
+
+    names = groups.to_numpy()
+    columns = [frame[column].to_numpy() for column in (x, y) + extra]
+    return [(str(names[start]),) + tuple(values[start:end] for values in columns)
+            for start, end in zip(starts, ends)]
+
+
+def line_figure(series, title, x_label, y_label, legend_title, webgl=False, meta=None):
+    # One line per (name, x, y) series
+    data = [
+        {
+            'type': 'scattergl' if webgl else 'scatter',
+            'mode': 'lines',
+            'name': name,
+            'legendgroup': name,
+            'showlegend': True,
+            'x': xs,
+            'y': ys,
+            'line': {'color': PALETTE[i % len(PALETTE)], 'dash': 'solid', 'width': 2},
+            'hovertemplate': f"{legend_title}={name}<br>{x_label}=%{{x}}<br>{y_label}=%{{y}}<extra></extra>",
+        }
+        for i, (name, xs, ys) in enumerate(series)
+    ]
+    layout = {
+        'title': {'text': title},
+        'xaxis': {'title': {'text': x_label}},
+        'yaxis': {'title': {'text': y_label}},
+        'legend': {'title': {'text': legend_title}},
+    }
+    if meta is not None:
+        layout['meta'] = meta
+    return make_figure(data, layout)
+
+
+def scatter_figure(series, title, x_label, y_label, legend_title, hover_label, legend=True):
+    # One marker trace per (name, x, y, hover values) series. Without a legend
+    # the series are drawn unnamed, as for a single selected country.
+    webgl = sum(len(xs) for _, xs, _, _ in series) > SCATTER_WEBGL_POINTS
+    data = []
+    for i, (name, xs, ys, hover) in enumerate(series):
+        heading = f"<b>{name}</b><br><br>{legend_title}={name}<br>" if legend else ""
+        data.append({
+            'type': 'scattergl' if webgl else 'scatter',
+            'mode': 'markers',
+            'name': name if legend else '',
+            'legendgroup': name if legend else '',
+            'showlegend': legend,
+            'x': xs,
+            'y': ys,
+            'customdata': hover,
+            'marker': {'color': PALETTE[i % len(PALETTE)], 'symbol': 'circle'},
+            'hovertemplate': (f"{heading}{x_label}=%{{x}}<br>{y_label}=%{{y}}<br>"
+                              f"{hover_label}=%{{customdata}}<extra></extra>"),
+        })
+    layout = {
+        'title': {'text': title},
+        'xaxis': {'title': {'text': x_label}},
+        'yaxis': {'title': {'text': y_label}},
+    }
+    if legend:
+        layout['legend'] = {'title': {'text': legend_title}}
+    return make_figure(data, layout)
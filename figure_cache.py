@@ -0,0 +1,178 @@
+# Bounded LRU cache of serialized figures, keyed by the normalized filter state.
+# Repeat views are answered from the stored JSON without touching pandas or
+# plotly. The cache empties itself whenever the data store reloads the dataset;
+# after an incremental refresh only the figures the change overlaps are dropped.
+import json
+import threading
+from collections import OrderedDict
+
+import config
+import data_store
+from figure_builder import figure_json
+from metrics import PhaseTimer, observe_payload, register_collector
+from rollups import expand_selection
+from single_flight import coalesce
+
+
+def cache_key(kind, selected_countries, start_year, end_year):
+    # Canonical form of a request: 'all' for every country (including an empty
+    # selection), otherwise the sorted set of country names
+    if isinstance(selected_countries, str):
+        selected_countries = [selected_countries]
+    countries = sorted({str(country).strip() for country in selected_countries or []})
+    if not countries or countries == ['all']:
+        countries = 'all'
+    else:
+        countries = tuple(countries)
+
+    def year(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    return kind, countries, year(start_year), year(end_year)
+
+
+def serialize_figure(kind, figure):
+    if isinstance(figure, str):
+        return figure
+    timer = PhaseTimer(kind)
+    payload = figure_json(figure)
+    timer.mark('serialize')
+    return payload
+
+
+class FigureCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> serialized figure
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        # Drop what was built from older data: the figures an incremental
+        # refresh touched, or everything after a full load
+        version = data_store.dataset_version()
+        if version == self._version:
+            return
+        changes = data_store.changes_since(self._version)
+        if changes is None:
+            self._entries.clear()
+            self._bytes = 0
+        else:
+            for update in changes:
+                self._invalidate(update)
+        self._version = version
+
+    def _invalidate(self, update):
+        # Figures whose countries and years include a changed record
+        co2_index = data_store.get_index()
+        for key in list(self._entries):
+            _, countries, start_year, end_year = key
+            rows = None if countries == 'all' else co2_index.country_positions(expand_selection(countries))
+            if update.overlaps(rows, start_year, end_year):
+                self._bytes -= len(self._entries.pop(key))
+
+    def get(self, key):
+        with self._lock:
+            self._check_version()
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def __contains__(self, key):
+        # Whether key is cached, without counting a hit or miss
+        with self._lock:
+            self._check_version()
+            return key in self._entries
+
+    def put(self, key, payload, version=None):
+        # version: dataset version the payload was built from; it is dropped
+        # when the dataset was reloaded since
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_version()
+            if version is not None and version != self._version:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = payload
+            self._bytes += size
+
+            # Evict least recently used figures until we are back under budget
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_or_build(self, key, build_figure):
+        # Serialized JSON for key, building (and caching) the figure on a miss.
+        # build_figure may return a plotly figure or JSON it already serialized.
+        # Identical requests that miss at the same time share one build; the
+        # result is cached however it was obtained, including when another
+        # worker built it, unless the dataset was reloaded meanwhile. (A build
+        # that loads the dataset for the first time has nothing older to be
+        # stale against.)
+        version = data_store.dataset_version() if data_store.is_loaded() else None
+        payload = self.get(key)
+        if payload is None:
+            payload = coalesce(key, lambda: serialize_figure(key[0], build_figure()))
+            self.put(key, payload, version)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# Shared by every callback in the process
+figure_cache = FigureCache(config.FIGURE_CACHE_MAX_BYTES)
+
+
+def _collect_metrics():
+    stats = figure_cache.stats()
+    return {
+        'co2_dashboard_figure_cache_hits_total': ('counter', "Figures served from the cache.", stats['hits']),
+        'co2_dashboard_figure_cache_misses_total': ('counter', "Figures that had to be built.", stats['misses']),
+        'co2_dashboard_figure_cache_evictions_total': ('counter', "Figures evicted to stay under the size limit.",
+                                                       stats['evictions']),
+        'co2_dashboard_figure_cache_bytes': ('gauge', "Serialized size of the cached figures.", stats['bytes']),
+        'co2_dashboard_figure_cache_entries': ('gauge', "Number of cached figures.", stats['entries']),
+    }
+
+
+register_collector('figure_cache', _collect_metrics)
+
+
+def cached_figure(kind, selected_countries, start_year, end_year, build_figure):
+    # Figure as a plain dict, ready to be returned from a Dash callback
+    key = cache_key(kind, selected_countries, start_year, end_year)
+    payload = figure_cache.get_or_build(key, build_figure)
+    observe_payload(kind, len(payload))
+    return json.loads(payload)
@@ -0,0 +1,85 @@
+# Partial figure updates. When the browser already shows a figure built by the
+# server, a filter change is answered with a dash.Patch that holds only what
+# differs from it: the x/y arrays of the traces a year change touched, the
+# traces inserted or deleted with a country, and the layout keys that changed.
+# The template, the unchanged traces and the rest of the layout stay in the
+# browser.
+import threading
+
+from dash import Patch
+
+from metrics import register_collector
+
+_lock = threading.Lock()
+_totals = {
+    'patches': 0,
+    'full': 0,
+}
+
+
+def _trace_names(figure):
+    return [trace.get('name') for trace in figure.get('data', [])]
+
+
+def _patch_dict(patch, old, new):
+    # Set the keys of new that differ from old and delete the keys new lacks
+    for key, value in new.items():
+        if key not in old or old[key] != value:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            del patch[key]
+
+
+def figure_patch(old, new):
+    # Patch turning the figure dict old into new, or None when new cannot be
+    # reached by editing traces in place, deleting some and inserting others
+    # (e.g. the traces were reordered), in which case the whole figure is sent
+    old_names, new_names = _trace_names(old), _trace_names(new)
+    if len(set(old_names)) != len(old_names) or len(set(new_names)) != len(new_names):
+        return _record(None)
+
+    kept = [name for name in old_names if name in new_names]
+    if [name for name in new_names if name in kept] != kept:
+        return _record(None)
+
+    patch = Patch()
+    # Delete from the end so the positions of the traces not yet deleted hold
+    for position in reversed(range(len(old_names))):
+        if old_names[position] not in new_names:
+            del patch['data'][position]
+
+    # Then walk the new traces in order: after the inserts before it, each
+    # kept trace is at its new position
+    old_traces = {trace.get('name'): trace for trace in old.get('data', [])}
+    for position, trace in enumerate(new.get('data', [])):
+        if trace.get('name') not in old_traces:
+            patch['data'].insert(position, trace)
+        elif old_traces[trace.get('name')] != trace:
+            _patch_dict(patch['data'][position], old_traces[trace.get('name')], trace)
+
+    if old.get('layout') != new.get('layout'):
+        _patch_dict(patch['layout'], old.get('layout', {}), new.get('layout', {}))
+    if old.get('frames') != new.get('frames'):
+        patch['frames'] = new.get('frames', [])
+    return _record(patch)
+
+
+def _record(patch):
+    with _lock:
+        _totals['full' if patch is None else 'patches'] += 1
+    return patch
+
+
+def _collect_metrics():
+    with _lock:
+        totals = dict(_totals)
+    return {
+        'co2_dashboard_figure_patches_total': ('counter', "Filter changes answered with a partial figure update.",
+                                               totals['patches']),
+        'co2_dashboard_figure_patch_fallbacks_total': ('counter', "Filter changes that needed the whole figure.",
+                                                       totals['full']),
+    }
+
+
+register_collector('figure_patch', _collect_metrics)
@@ -0,0 +1,182 @@
+# Worker pool for building several figures at once (config.FIGURE_POOL): the
+# default view of every tab during warmup, and the other tabs of a view in the
+# background while the user looks at one. Threads share the process' dataset
+# directly; the numpy and pandas work of the builders releases the GIL often
+# enough for them to overlap. Worker processes are spawned as fresh
+# interpreters rather than forked from the (threaded) server process, so they
+# cannot inherit a lock another thread was holding; they map the dataset's
+# binary cache, so its arrays are shared through the page cache, and are
+# replaced when the data store reloads.
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import config
+import data_store
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pool = {'executor': None, 'version': None}
+_pending = {}  # name -> future of a background task still running
+_totals = {
+    'tasks': 0,
+    'failures': 0,
+    'timeouts': 0,
+    'prefetches': 0,
+}
+
+
+def _after_fork():
+    # A forked gunicorn worker inherits the pool object but not its threads or
+    # processes; it starts its own on first use
+    global _lock
+    _lock = threading.Lock()
+    _pool.update(executor=None, version=None)
+    _pending.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _executor():
+    with _lock:
+        if config.FIGURE_POOL == 'process':
+            # Start new workers after a (re)load so they do not keep serving
+            # the old data. The workers load the dataset themselves, so the
+            # default view can be served from the snapshot without loading it.
+            version = data_store.dataset_version()
+            if _pool['executor'] is not None and _pool['version'] != version:
+                _pool['executor'].shutdown(wait=False)
+                _pool['executor'] = None
+            if _pool['executor'] is None:
+                _pool['executor'] = ProcessPoolExecutor(config.FIGURE_POOL_WORKERS,
+                                                        mp_context=multiprocessing.get_context('spawn'))
+                _pool['version'] = version
+        elif _pool['executor'] is None:
+            _pool['executor'] = ThreadPoolExecutor(config.FIGURE_POOL_WORKERS, thread_name_prefix='figure')
+        return _pool['executor']
+
+
+def shutdown():
+    # Stop the pool after its running tasks; the next use starts a new one
+    with _lock:
+        executor, _pool['executor'] = _pool['executor'], None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def _record(failures=0, timeouts=0, tasks=0, prefetches=0):
+    with _lock:
+        _totals['tasks'] += tasks
+        _totals['failures'] += failures
+        _totals['timeouts'] += timeouts
+        _totals['prefetches'] += prefetches
+
+
+def run_all(tasks, fallback, timeout=None):
+    # Run {name: (function, args)} and return {name: result}. A task that
+    # raises, or has not finished timeout seconds after it was submitted, gets
+    # fallback(name) as its result. A timed-out task is abandoned, not killed:
+    # its worker finishes it in the background. With the pool off the tasks run
+    # inline and only errors get the fallback.
+    timeout = config.FIGURE_TIMEOUT_SECONDS if timeout is None else timeout
+    _record(tasks=len(tasks))
+
+    if config.FIGURE_POOL == 'off':
+        results = {}
+        for name, (function, args) in tasks.items():
+            try:
+                results[name] = function(*args)
+            except Exception:
+                logger.exception("Building %s failed", name)
+                _record(failures=1)
+                results[name] = fallback(name)
+        return results
+
+    executor = _executor()
+    started = time.monotonic()
+    futures = {name: executor.submit(function, *args) for name, (function, args) in tasks.items()}
+
+    results = {}
+    for name, future in futures.items():
+        remaining = max(0.0, timeout - (time.monotonic() - started)) if timeout else None
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning("Building %s timed out after %.1fs", name, timeout)
+            _record(timeouts=1)
+            results[name] = fallback(name)
+        except Exception:
+            logger.exception("Building %s failed", name)
+            _record(failures=1)
+            results[name] = fallback(name)
+    return results
+
+
+def prefetch(tasks, on_result):
+    # Submit {name: (function, args)} without waiting for them;
+    # on_result(name, result) is called as each succeeds. A name already
+    # running in the background is not submitted again.
+    if config.FIGURE_POOL == 'off':
+        return
+    executor = _executor()
+    for name, (function, args) in tasks.items():
+        with _lock:
+            if name in _pending:
+                continue
+            future = _pending[name] = executor.submit(function, *args)
+        _record(tasks=1, prefetches=1)
+        future.add_done_callback(lambda future, name=name: _prefetched(name, future, on_result))
+
+
+def _prefetched(name, future, on_result):
+    with _lock:
+        if _pending.get(name) is future:
+            del _pending[name]
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error("Building %s in the background failed", name, exc_info=error)
+        _record(failures=1)
+        return
+    on_result(name, future.result())
+
+
+def wait_pending(name, timeout=None):
+    # Result of the background task for name when one is running, else None
+    timeout = config.FIGURE_TIMEOUT_SECONDS if timeout is None else timeout
+    with _lock:
+        future = _pending.get(name)
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=timeout or None)
+    except Exception:
+        # Timed out or failed (logged by _prefetched): the caller builds it
+        return None
+
+
+def _collect_metrics():
+    with _lock:
+        totals = dict(_totals)
+    return {
+        'co2_dashboard_figure_pool_tasks_total': ('counter', "Figures submitted to the figure pool.",
+                                                  totals['tasks']),
+        'co2_dashboard_figure_pool_failures_total': ('counter', "Figures replaced by a fallback after an error.",
+                                                     totals['failures']),
+        'co2_dashboard_figure_pool_timeouts_total': ('counter', "Figures replaced by a fallback after a timeout.",
+                                                     totals['timeouts']),
+        'co2_dashboard_figure_pool_prefetches_total': ('counter', "Figures built in the background ahead of a request.",
+                                                       totals['prefetches']),
+    }
+
+
+register_collector('figure_pool', _collect_metrics)
@@ -0,0 +1,23 @@
+# gunicorn settings for the production entry point (see wsgi.py):
+#
+#   gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+import os
+import sys
+
+# gunicorn loads this file before the app, so make the dashboard modules importable
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# (imported by name: "config" is itself a gunicorn setting)
+from config import SERVER_BIND, SERVER_THREADS, SERVER_WORKERS
+
+bind = SERVER_BIND
+workers = SERVER_WORKERS
+threads = SERVER_THREADS
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Import the app (and run its warmup) in the master process before forking,
+# so the workers share the loaded dataset instead of each loading their own
+preload_app = True
+
+# Figure builds on large selections can take a few seconds
+timeout = 60
@@ -0,0 +1,131 @@
+# In-process metrics for the dashboard: per-phase durations of the figure
+# builders, row counts, payload sizes and callback latencies, kept as
+# histograms and exposed in the Prometheus text format on /metrics.
+import functools
+import logging
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                labels = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, label_values))
+                prefix = f"{labels}," if labels else ''
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound:g}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{labels}}} {total:.6f}")
+                lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+phase_seconds = Histogram('co2_dashboard_phase_seconds', "Time spent in each phase of a figure build.",
+                          ('builder', 'phase'), DURATION_BUCKETS)
+rows = Histogram('co2_dashboard_rows', "Rows a figure was built from.", ('builder',), ROW_BUCKETS)
+payload_bytes = Histogram('co2_dashboard_payload_bytes', "Serialized figure size returned to the browser.",
+                          ('figure',), BYTE_BUCKETS)
+callback_seconds = Histogram('co2_dashboard_callback_seconds', "Latency of Dash callbacks that did work.",
+                             ('callback',), DURATION_BUCKETS)
+
+HISTOGRAMS = [phase_seconds, rows, payload_bytes, callback_seconds]
+
+# name -> function returning {metric name: (type, help, value)} gathered at scrape time
+_collectors = {}
+
+
+class PhaseTimer:
+    # Records the time since the previous mark (or since creation) as the
+    # duration of the named phase:
+    #
+    #   timer = PhaseTimer('co2-trend')
+    #   ...load...
+    #   timer.mark('load')
+
+    def __init__(self, builder):
+        self.builder = builder
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        phase_seconds.observe(now - self._last, self.builder, phase)
+        self._last = now
+
+
+def observe_rows(builder, count):
+    rows.observe(count, builder)
+
+
+def observe_payload(figure, size):
+    payload_bytes.observe(size, figure)
+
+
+def instrument_callback(name):
+    # Time a callback and log it with its arguments when it is slow. Callbacks
+    # that decide not to update (PreventUpdate) are not recorded.
+    def decorator(callback):
+        @functools.wraps(callback)
+        def wrapper(*args):
+            started = time.perf_counter()
+            result = callback(*args)
+            elapsed = time.perf_counter() - started
+            callback_seconds.observe(elapsed, name)
+            if config.SLOW_REQUEST_SECONDS and elapsed >= config.SLOW_REQUEST_SECONDS:
+                logger.warning("Slow callback %s: %.3fs with arguments %r", name, elapsed, args)
+            return result
+        return wrapper
+    return decorator
+
+
+def register_collector(name, collect):
+    _collectors[name] = collect
+
+
+def render():
+    # All metrics in the Prometheus text exposition format
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for collect in _collectors.values():
+        for metric, (metric_type, help_text, value) in collect().items():
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            lines.append(f"{metric} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def register_routes(server):
+    # Add the /metrics route to the Flask server behind the Dash app
+    @server.route('/metrics')
+    def prometheus_metrics():
+        return render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -1,91 +1,56 @@
 # Second Tab shows the population trend of each country.
-import plotly.express as px
-from co2_data import clean_data
+from co2_data import register_columns
+from data_store import get_index
+from figure_builder import group_series, line_figure, message_figure
+from metrics import PhaseTimer, observe_rows
+from render_policy import apply_line_policy
+from rollups import rollup_frame, split_selection, with_countries
+
+register_columns(__name__, ['population'])
 
 def create_population_trend_figure(selected_countries, start_date, end_date):
 
-    # Filter data based on selected countries and date range
-    co2_data = clean_data("owid-co2-data.csv")
+    # Dense country x year arrays of the dataset
+    timer = PhaseTimer('population-trend')
+    co2_index = get_index()
+    timer.mark('load')
 
     # Check if start_date and end_date are None (or empty)
     if start_date is None or end_date is None:
         # Optionally handle the case where no date range is selected (e.g., use the full range or return an error)
-        return px.bar(
-            title="Please select a valid date range.",
-            labels={"emissions": "Total Emissions", "year": "Year"}
-        )
+        return message_figure("Please select a valid date range.")
 
     # Ensure valid date range format (YYYY-MM-DD) and convert to year integer
     try:
         start_year = int(start_date[:4])
         end_year = int(end_date[:4])
     except ValueError:
-        return px.bar(
-            title="Invalid date range selected.",
-            labels={"emissions": "Total Emissions", "year": "Year"}
-        )
-
-    co2_data = co2_data[co2_data['year'].between(int(start_date[:4]), int(end_date[:4]))]
-
-    # Handle the case where no country is selected (None or empty)
-    if not selected_countries or selected_countries == 'all':
-        selected_countries = co2_data['country'].unique()  # Default to all countries
-    else:
-        # Ensure selected_countries is always a list
-        if isinstance(selected_countries, str):
-            selected_countries = [selected_countries]
-
-    # Filter data for the selected countries
-    co2_data = co2_data[co2_data['country'].isin(selected_countries)]
-
-    # Selecting the necessary columns for the graph
-    population_by_country = co2_data[['country', 'year', 'population']]
-
-    # Create interactive line chart
-    fig = px.line(
-        population_by_country,
-        x="year",
-        y="population",
-        color="country",
-        title="Population Growth Trend",
-        labels={"population": "Population (in millions)", "year": "Year"},
-    )
-
-    # Define the custom color palette
-    color_palette = px.colors.qualitative.Set1
-
-    # Apply the color palette to the chart
-    fig.update_traces(marker=dict(line=dict(width=2, color='white')), 
-                      line=dict(width=2), 
-                      marker_color=color_palette)
-
-    # Customize the layout for light background, plot area with light blue, and border
-    fig.update_layout(
-        title=dict(
-            text="Population Trend by Country",
-            x=0.5,  # Center the title
-            y=0.95,  # Adjust the position
-            font=dict(size=24, color="black")  # Black title color
-        ),
-        paper_bgcolor='white',  # White background for the overall chart
-        font=dict(color="black", family="Roboto, sans-serif"),  # Black text color
-        plot_bgcolor='white',  # Light blue plot area background (hex code)
-        xaxis=dict(
-            tickfont=dict(color="black"),  # Black color for x-axis ticks
-            title_font=dict(color="black"),  # Black color for x-axis title
-            showgrid=False,  # No grid lines
-            linecolor="gray",  # Border color for x-axis
-            linewidth=2,  # Line width for x-axis border
-        ),
-        yaxis=dict(
-            tickfont=dict(color="black"),  # Black color for y-axis ticks
-            title_font=dict(color="black"),  # Black color for y-axis title
-            showgrid=False,  # No grid lines
-            linecolor="black",  # Border color for y-axis
-            linewidth=2,  # Line width for y-axis border
-        ),
-        margin=dict(l=50, r=50, t=50, b=50),  # Adjusting margins for better space
+        return message_figure("Invalid date range selected.")
+
+    # Regions (the world and continents for 'all') are drawn from the
+    # precomputed rollups, countries from the index. Country names are matched
+    # case- and whitespace-insensitively by the index.
+    regions, countries = split_selection(selected_countries)
+    population_by_country = with_countries(rollup_frame(co2_index, 'population', regions, start_year, end_year),
+                                           co2_index.to_frame(['population'], countries, start_year, end_year))
+
+    # Large selections are drawn with WebGL and optionally downsampled
+    population_by_country, render_mode, render_stats = apply_line_policy(population_by_country, 'year', 'population', 'country')
+
+    observe_rows('population-trend', len(population_by_country))
+    timer.mark('filter')
+
+    # One line per country, built straight from the frame's arrays
+    fig = line_figure(
+        group_series(population_by_country, 'country', 'year', 'population'),
+        title="Population Trend by Country",
+        x_label="Year",
+        y_label="Population (in millions)",
+        legend_title="country",
+        webgl=render_mode == 'webgl',
+        meta={'render_policy': render_stats},  # How many points were drawn and dropped
     )
 
+    timer.mark('figure')
     return fig
 
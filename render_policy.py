@@ -0,0 +1,135 @@
+# Rendering policy for the line charts: WebGL traces for large figures and
+# optional LTTB (largest-triangle-three-buckets) downsampling of each series.
+import logging
+import threading
+
+import numpy as np
+
+import config
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_totals = {
+    'figures': 0,
+    'webgl_figures': 0,
+    'points_in': 0,
+    'points_out': 0,
+}
+
+
+def lttb_indices(x, y, target):
+    # Indices of the points LTTB keeps when reducing (x, y) to `target` points.
+    # The first and last points are always kept.
+    n = len(x)
+    if target >= n or target < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket boundaries for the n - 2 points between the first and the last
+    edges = np.linspace(1, n - 1, target - 1).astype(np.intp)
+    selected = np.empty(target, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(target - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Average of the next bucket (or the last point) as the third vertex
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # Keep the point spanning the largest triangle with the previous pick
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def downsample_series(x, y, target):
+    # LTTB over the finite stretches of a series, keeping one missing point
+    # between stretches so the line still shows its gaps
+    finite = np.isfinite(y)
+    total = int(finite.sum())
+    if total <= target:
+        return np.arange(len(y))
+
+    # Start/end of each run of finite values
+    changes = np.flatnonzero(np.diff(np.concatenate(([0], finite.astype(np.int8), [0]))))
+    runs = changes.reshape(-1, 2)
+
+    keep = []
+    for start, end in runs:
+        run_target = max(2, int(round(target * (end - start) / total)))
+        keep.append(start + lttb_indices(x[start:end], y[start:end], run_target))
+        if end < len(y):
+            keep.append(np.array([end]))
+    return np.concatenate(keep)
+
+
+def apply_line_policy(frame, x, y, group):
+    # Decide how a long-form line chart frame is drawn. Returns the (possibly
+    # downsampled) frame, the render mode ('webgl' or 'svg') and per-figure stats.
+    points_in = len(frame)
+
+    if config.DOWNSAMPLE_LINES and points_in:
+        target = max(3, config.PLOT_WIDTH_PX)
+        positions = []
+        # Rows of the frame are grouped by series, so each group is contiguous
+        groups = frame[group].to_numpy()
+        boundaries = np.flatnonzero(groups[1:] != groups[:-1]) + 1
+        xs = frame[x].to_numpy(dtype=np.float64)
+        ys = frame[y].to_numpy(dtype=np.float64)
+        for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [points_in]))):
+            positions.append(start + downsample_series(xs[start:end], ys[start:end], target))
+        frame = frame.iloc[np.concatenate(positions)]
+
+    points_out = len(frame)
+    webgl = points_out > config.WEBGL_POINT_THRESHOLD
+
+    stats = {
+        'points_in': points_in,
+        'points_out': points_out,
+        'points_dropped': points_in - points_out,
+        'webgl': webgl,
+    }
+    with _lock:
+        _totals['figures'] += 1
+        _totals['webgl_figures'] += int(webgl)
+        _totals['points_in'] += points_in
+        _totals['points_out'] += points_out
+    logger.debug("Line chart: %d of %d points kept, webgl=%s", points_out, points_in, webgl)
+
+    return frame, 'webgl' if webgl else 'svg', stats
+
+
+def policy_stats():
+    # Totals since the process started
+    with _lock:
+        totals = dict(_totals)
+    totals['points_dropped'] = totals['points_in'] - totals['points_out']
+    return totals
+
+
+def _collect_metrics():
+    totals = policy_stats()
+    return {
+        'co2_dashboard_line_points_in_total': ('counter', "Points in line charts before downsampling.",
+                                               totals['points_in']),
+        'co2_dashboard_line_points_dropped_total': ('counter', "Points removed by LTTB downsampling.",
+                                                    totals['points_dropped']),
+        'co2_dashboard_webgl_figures_total': ('counter', "Line charts drawn with WebGL traces.",
+                                              totals['webgl_figures']),
+    }
+
+
+register_collector('render_policy', _collect_metrics)
@@ -0,0 +1,200 @@
+# Regional rollups: world, continent and income-group totals of the country
+# series, computed once per load. Countries are assigned to regions through
+# config.REGIONS_FILE (iso_code, continent, income_group). The "all" view of
+# the trend charts draws the world and continent series instead of one line
+# per country, and a region's line can be drilled down into its members.
+import csv
+import functools
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import config
+from co2_data import register_columns
+from data_index import normalize_name
+from data_store import get_derived, get_index, register_derived
+
+WORLD = 'World'
+
+# Metrics summed over the member countries
+ROLLUP_METRICS = ['co2', 'population']
+register_columns(__name__, ROLLUP_METRICS)
+
+# Income groups from richest to poorest, the order they are listed in
+INCOME_GROUPS = ['High-income countries', 'Upper-middle-income countries',
+                 'Lower-middle-income countries', 'Low-income countries']
+
+
+@functools.lru_cache(maxsize=4)
+def load_regions(path=None):
+    # iso_code -> (continent, income group); empty without a mapping file
+    try:
+        with open(path or config.REGIONS_FILE, newline='') as f:
+            return {row['iso_code']: (row.get('continent') or None, row.get('income_group') or None)
+                    for row in csv.DictReader(f)}
+    except OSError:
+        return {}
+
+
+def continents():
+    return sorted({continent for continent, _ in load_regions().values() if continent})
+
+
+def income_groups():
+    groups = {group for _, group in load_regions().values() if group}
+    return sorted(groups, key=lambda group: (INCOME_GROUPS.index(group) if group in INCOME_GROUPS else len(INCOME_GROUPS), group))
+
+
+def region_names():
+    # World, the continents and the income groups, in the order they are shown
+    return [WORLD] + continents() + income_groups()
+
+
+def region_name(name):
+    # Canonical region name for a (case- and whitespace-insensitive) name, or None
+    names = {normalize_name(region): region for region in region_names()}
+    return names.get(normalize_name(name))
+
+
+def default_regions():
+    # Series the "all" view draws
+    return [WORLD] + continents()
+
+
+def _region_members(co2_index, name):
+    if name == WORLD:
+        return np.arange(len(co2_index.countries))
+    regions = load_regions()
+    return np.array([i for i, iso_code in enumerate(co2_index.iso_codes)
+                     if name in regions.get(iso_code, ())], dtype=np.intp)
+
+
+def _region_totals(co2_index, members, years=slice(None)):
+    # Sum of each metric over the members; NaN in years where no member has a value
+    totals = {}
+    for metric in ROLLUP_METRICS:
+        values = co2_index.metrics[metric][members, years]
+        known = np.isfinite(values).any(axis=0)
+        totals[metric] = np.where(known, np.nansum(values, axis=0), np.nan)
+    present = co2_index.present[members, years].any(axis=0)
+    return totals, present
+
+
+def build_rollups(co2_index):
+    names = region_names()
+    members = [_region_members(co2_index, name) for name in names]
+
+    shape = (len(names), len(co2_index.years))
+    metrics = {metric: np.full(shape, np.nan) for metric in ROLLUP_METRICS}
+    present = np.zeros(shape, dtype=bool)
+    for i, rows in enumerate(members):
+        totals, present[i] = _region_totals(co2_index, rows)
+        for metric in ROLLUP_METRICS:
+            metrics[metric][i] = totals[metric]
+
+    return _freeze({'names': names, 'members': members, 'metrics': metrics, 'present': present})
+
+
+def update_rollups(co2_index, rollups, update):
+    # After an incremental refresh only the regions with a changed member are
+    # summed again
+    metrics = {metric: update.grow(values) for metric, values in rollups['metrics'].items()}
+    present = update.grow(rollups['present'], False)
+    for i, rows in enumerate(rollups['members']):
+        if not np.isin(update.rows, rows).any():
+            continue
+        totals, present[i] = _region_totals(co2_index, rows)
+        for metric in ROLLUP_METRICS:
+            metrics[metric][i] = totals[metric]
+
+    return _freeze(dict(rollups, metrics=metrics, present=present))
+
+
+def _freeze(rollups):
+    rollups['present'].flags.writeable = False
+    for values in rollups['metrics'].values():
+        values.flags.writeable = False
+    return rollups
+
+
+register_derived('rollups', build_rollups, update_rollups)
+
+
+def split_selection(selected):
+    # (regions, countries) of a dropdown selection. Selecting every country
+    # means the default regions and no individual countries.
+    if not selected or selected == 'all' or list(selected) == ['all']:
+        return default_regions(), []
+    if isinstance(selected, str):
+        selected = [selected]
+
+    # Regions are listed in their fixed order, whatever order they were
+    # picked in, so a selection draws the same figure as the cache key it maps to
+    regions, countries = set(), []
+    for name in selected:
+        region = region_name(name)
+        if region is None:
+            countries.append(name)
+        else:
+            regions.add(region)
+    return [region for region in region_names() if region in regions], countries
+
+
+def expand_selection(selected):
+    # Country names of a selection with every region replaced by its member
+    # countries, for the charts that draw countries only
+    if isinstance(selected, str):
+        selected = [selected]
+    regions, countries = split_selection(selected)
+    if not regions:
+        return countries
+
+    rollups = get_derived('rollups')
+    for region in regions:
+        rows = rollups['members'][rollups['names'].index(region)]
+        countries.extend(get_index().countries[rows].tolist())
+    return list(dict.fromkeys(countries))
+
+
+def rollup_frame(co2_index, metric, regions, start_year=None, end_year=None):
+    # Long-form frame (country, year, metric) of the given regions' series in
+    # the order given, like CountryYearIndex.to_frame returns countries
+    rollups = get_derived('rollups')
+    rows = np.array([rollups['names'].index(region) for region in regions], dtype=np.intp)
+    years = co2_index.year_slice(start_year, end_year)
+
+    row_idx, col_idx = np.nonzero(rollups['present'][rows, years])
+    return pd.DataFrame({
+        'country': pd.Categorical.from_codes(row_idx, categories=regions),
+        'year': co2_index.years[years][col_idx],
+        metric: rollups['metrics'][metric][rows, years][row_idx, col_idx],
+    })
+
+
+def with_countries(rollup_frame, country_frame):
+    # Region series followed by country series, as one frame with a
+    # categorical country column
+    if country_frame.empty:
+        return rollup_frame
+    if rollup_frame.empty:
+        return country_frame
+    frame = pd.concat([rollup_frame, country_frame], ignore_index=True)
+    frame['country'] = union_categoricals([rollup_frame['country'], country_frame['country']])
+    return frame
+
+
+def series_names(co2_index, metric, regions, start_year=None, end_year=None):
+    # Regions that get a line for this selection: those with data in the range
+    frame = rollup_frame(co2_index, metric, regions, start_year, end_year)
+    return frame['country'].unique().tolist()
+
+
+def drill_down(region):
+    # Selection that shows the next level below a region: the continents below
+    # the world, the member countries below a continent or income group
+    rollups = get_derived('rollups')
+    if region == WORLD and continents():
+        return continents()
+    rows = rollups['members'][rollups['names'].index(region)]
+    return get_index().countries[rows].tolist()
@@ -0,0 +1,163 @@
+# Single-flight coalescing of identical concurrent requests
+# (config.SINGLE_FLIGHT). The first request for a key computes the serialized
+# result; requests for the same key that arrive while it runs wait for it and
+# share that result instead of computing it again. Across gunicorn workers
+# ("process" mode) the computation is guarded by a lock file in the dataset's
+# cache directory and the result is left next to it for
+# SINGLE_FLIGHT_RESULT_SECONDS, so the workers that waited on the lock can
+# read it.
+import glob
+import hashlib
+import os
+import threading
+import time
+
+import config
+import data_store
+from co2_data import cache_dir
+from metrics import register_collector
+
+try:
+    import fcntl
+except ImportError:  # Windows: requests are only coalesced within a worker
+    fcntl = None
+
+_lock = threading.Lock()
+_in_flight = {}
+_totals = {
+    'leaders': 0,
+    'coalesced': 0,
+    'shared': 0,
+}
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _record(**counts):
+    with _lock:
+        for name, count in counts.items():
+            _totals[name] += count
+
+
+def shared_dir():
+    return os.path.join(cache_dir(data_store.data_path()), 'single-flight')
+
+
+def _shared_path(key):
+    # Results of different datasets never share a file
+    digest = hashlib.sha1(repr((data_store.dataset_fingerprint(), key)).encode()).hexdigest()
+    return os.path.join(shared_dir(), digest)
+
+
+def _read_shared(path):
+    try:
+        if time.time() - os.path.getmtime(path) > config.SINGLE_FLIGHT_RESULT_SECONDS:
+            return None
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write_shared(path, result):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(result)
+        os.replace(tmp_path, path)
+    except OSError:
+        return
+
+    # Drop the results nobody can use any more
+    cutoff = time.time() - config.SINGLE_FLIGHT_RESULT_SECONDS
+    for stale in glob.glob(os.path.join(shared_dir(), '*.result')):
+        try:
+            if os.path.getmtime(stale) < cutoff:
+                os.remove(stale)
+        except OSError:
+            pass
+
+
+def _compute_across_workers(key, compute):
+    # Hold the key's lock file while computing, so a worker that asks for the
+    # same key meanwhile blocks and then reads the result instead. Keys share
+    # 256 lock files rather than filling the directory with one per key.
+    path = _shared_path(key)
+    try:
+        os.makedirs(shared_dir(), exist_ok=True)
+        lock_file = open(os.path.join(shared_dir(), f"lock-{os.path.basename(path)[:2]}"), 'a')
+    except OSError:
+        return compute()
+
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            result = _read_shared(f"{path}.result")
+            if result is not None:
+                _record(shared=1)
+                return result
+            result = compute()
+            _write_shared(f"{path}.result", result)
+            return result
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def coalesce(key, compute):
+    # compute() for the first caller of key; callers that arrive while it runs
+    # get the same (string) result, or the same exception
+    if config.SINGLE_FLIGHT == 'off':
+        return compute()
+
+    with _lock:
+        call = _in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = _in_flight[key] = _Call()
+            _totals['leaders'] += 1
+        else:
+            _totals['coalesced'] += 1
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        if config.SINGLE_FLIGHT == 'process' and fcntl is not None:
+            call.result = _compute_across_workers(key, compute)
+        else:
+            call.result = compute()
+        return call.result
+    except Exception as error:
+        call.error = error
+        raise
+    finally:
+        with _lock:
+            del _in_flight[key]
+        call.done.set()
+
+
+def _collect_metrics():
+    with _lock:
+        totals = dict(_totals)
+    return {
+        'co2_dashboard_single_flight_leaders_total': ('counter', "Requests that computed their result.",
+                                                      totals['leaders']),
+        'co2_dashboard_single_flight_coalesced_total': ('counter',
+                                                        "Requests that waited for an identical request in the worker.",
+                                                        totals['coalesced']),
+        'co2_dashboard_single_flight_shared_total': ('counter',
+                                                     "Requests answered with a result computed by another worker.",
+                                                     totals['shared']),
+    }
+
+
+register_collector('single_flight', _collect_metrics)
@@ -0,0 +1,112 @@
+# On-disk snapshot of the dashboard's default view: the serialized default
+# figure of every tab, stored next to the dataset cache and keyed to the
+# dataset's SHA-256 and the settings that shape the figures, plus the country
+# list in a file of its own. A freshly started process can serve its first
+# page and default figures from them without loading the dataset.
+import hashlib
+import json
+import os
+import threading
+
+import config
+import data_store
+from co2_data import cache_dir
+
+# Bump whenever the figures of the default view change shape, so snapshots
+# taken by an older version are rebuilt
+SNAPSHOT_FORMAT = 2
+
+_lock = threading.Lock()
+
+# Country list of the last dataset it was read for, so page loads do not read
+# the file every time
+_countries = {'dataset': None, 'countries': None}
+
+
+def snapshot_path():
+    return os.path.join(cache_dir(data_store.data_path()), 'default-view.json')
+
+
+def countries_path():
+    return os.path.join(cache_dir(data_store.data_path()), 'countries.json')
+
+
+def settings_key():
+    # Hash of the settings the default figures depend on, so changing one
+    # (e.g. CO2_SOURCES_FRAME_MODE) rebuilds them instead of serving the old ones
+    try:
+        stat = os.stat(config.REGIONS_FILE)
+        regions = [stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        regions = None
+    settings = [SNAPSHOT_FORMAT, config.CO2_SOURCES_FRAME_MODE, config.DOWNSAMPLE_LINES,
+                config.WEBGL_POINT_THRESHOLD, config.PLOT_WIDTH_PX, config.REGIONS_FILE, regions]
+    return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+
+def load_snapshot():
+    # The snapshot, if it was taken from the current dataset with the current settings
+    try:
+        with open(snapshot_path()) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('settings') != settings_key() or snapshot.get('dataset') != data_store.known_fingerprint():
+        return None
+    return snapshot
+
+
+def _save(path, contents):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump(contents, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Without a writable cache directory the dashboard just starts cold
+        pass
+
+
+def snapshot_countries():
+    # Country list of the current dataset, or None when none was saved for it
+    dataset = data_store.known_fingerprint()
+    if dataset is None:
+        return None
+    if _countries['dataset'] != dataset:
+        try:
+            with open(countries_path()) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get('dataset') != dataset:
+            return None
+        _countries.update(dataset=dataset, countries=saved['countries'])
+    return _countries['countries']
+
+
+def default_figure(tab, build_payload):
+    # Serialized default figure for a tab, from the snapshot when it has one;
+    # otherwise built with build_payload() and added to the snapshot
+    snapshot = load_snapshot()
+    if snapshot and tab in snapshot['figures']:
+        return snapshot['figures'][tab]
+
+    payload = build_payload()
+
+    with _lock:
+        snapshot = load_snapshot()
+        if snapshot is None:
+            snapshot = {
+                'settings': settings_key(),
+                'dataset': data_store.dataset_fingerprint(),
+                'figures': {},
+            }
+            _save(countries_path(), {
+                'dataset': snapshot['dataset'],
+                'countries': data_store.get_index().countries.tolist(),
+            })
+        snapshot['figures'][tab] = payload
+        _save(snapshot_path(), snapshot)
+
+    return payload
@@ -0,0 +1,57 @@
+# Production entry point. The dataset, its indexes and the default figures are
+# prepared once in the gunicorn master before it forks, so every worker starts
+# warm and shares the loaded data copy-on-write:
+#
+#   gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+import logging
+import threading
+import time
+
+import data_store
+import figure_pool
+from app import (DEFAULT_COUNTRIES, DEFAULT_END_YEAR, DEFAULT_START_YEAR, SERVER_TABS, app,
+                 tab_figure_payload)
+from figure_cache import cache_key, figure_cache
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+
+
+def warmup():
+    # Load the data and build the default view of every tab into the figure
+    # cache, the tabs concurrently in the figure pool
+    started = time.perf_counter()
+    data_store.get_index()
+    default_view = (DEFAULT_COUNTRIES, DEFAULT_START_YEAR, DEFAULT_END_YEAR)
+    payloads = figure_pool.run_all({tab: (tab_figure_payload, (tab, *default_view)) for tab in SERVER_TABS},
+                                   fallback=lambda tab: None, timeout=0)
+    for tab, payload in payloads.items():
+        if payload is not None:
+            figure_cache.put(cache_key(tab, *default_view), payload)
+    # The master only forks the workers from here on; they start their own pool
+    figure_pool.shutdown()
+    _ready.set()
+    logger.info("Warmup finished in %.2fs", time.perf_counter() - started)
+
+
+def register_health_routes(server):
+
+    # Liveness: the process is up and serving requests
+    @server.route('/healthz')
+    def healthz():
+        return {'status': 'ok'}, 200
+
+    # Readiness: data loaded and default figures built
+    @server.route('/readyz')
+    def readyz():
+        if not _ready.is_set():
+            return {'status': 'warming up'}, 503
+        return {'status': 'ready', 'dataset': data_store.load_stats()}, 200
+
+
+def create_app():
+    # WSGI application factory
+    register_health_routes(app.server)
+    warmup()
+    return app.server